@@ -1,8 +1,8 @@
+import functools
+import hashlib
 import logging
-import random
-from hashlib import sha256
+import secrets
 
-import aioredis
 import pydantic
 import sqlalchemy as sa
 from fastapi import (
@@ -14,12 +14,29 @@ from fastapi.security import (
     OAuth2PasswordBearer,
     OAuth2PasswordRequestForm,
 )
-from sqlalchemy.ext.asyncio import AsyncConnection
 from starlette import status
 from starlette.requests import Request
+from starlette.responses import Response
 
 from app import models
+from app.core.cache import (
+    bump_generation,
+    get_generation,
+    make_cache_key,
+    versioned_prefix,
+)
+from app.core.queries import queries
+from app.core.session import LazyConnection
+from app.core.tokens import InvalidToken
+from app.settings import settings
+
+from .filters import user_name_filter
 
+# Failed logins are keyed by a generation, bumped whenever credentials
+# change, so a cached failure never outlives a matching user.
+AUTH_MISSING_PREFIX = "auth_missing"
+AUTH_MISSING_TTL = 30
+AUTH_MISSING_VERSION = 1
 logger = logging.getLogger(__name__)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth")
 auth_router = APIRouter()
@@ -30,36 +47,161 @@ class Token(pydantic.BaseModel):
     token_type: str
 
 
+queries.register(
+    "authenticate",
+    sa.select(models.User.id).where(
+        (models.User.name == sa.bindparam("name"))
+        & (models.User.password_hash == sa.bindparam("password_hash"))
+        & (models.User.deleted_at == None)
+    ),
+    warm_up={"name": "", "password_hash": ""},
+)
+
+
+def forget_failed_logins(request: Request) -> None:
+    """Drop cached failed logins once the request's changes commit."""
+    request.state.db.on_commit(
+        functools.partial(
+            bump_generation,
+            request.app.state.cache,
+            AUTH_MISSING_PREFIX,
+            request.app.state.local_cache,
+        )
+    )
+
+
+def _make_missing_key(generation: int, name: str, password_hash: str) -> str:
+    # Credentials are not kept in the cache as they are.
+    digest = hashlib.sha256(f"{name}\0{password_hash}".encode()).hexdigest()
+    return make_cache_key(
+        versioned_prefix(
+            AUTH_MISSING_PREFIX, AUTH_MISSING_VERSION, generation
+        ),
+        credentials=digest,
+    )
+
+
 @auth_router.post("/auth", response_model=Token)
 async def authenticate(
     request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
 ):
+    """Issue a token for a name and password.
+
+    Unknown names are told apart by a filter without a query, failed
+    logins are cached for a while. The password is hashed either way, so
+    response times do not tell which names exist.
+    """
     logger.debug(f"Got request: {form_data}")
-    db: AsyncConnection = request.state.db
-    users = await db.execute(
-        sa.select(models.User).where(
-            (models.User.name == form_data.username)
-            & (
-                models.User.password_hash
-                == sha256((form_data.password).encode()).hexdigest()
-            )
-            & (models.User.deleted_at == None)
-        )
+    db: LazyConnection = request.state.db
+    cache = request.app.state.cache
+    password_hash = await request.app.state.crypto.hash_password(
+        form_data.password
+    )
+    [maybe] = await user_name_filter.might_contain(cache, [form_data.username])
+    if not maybe:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
+    generation = await get_generation(
+        cache, AUTH_MISSING_PREFIX, request.app.state.local_cache
+    )
+    missing_key = _make_missing_key(
+        generation, form_data.username, password_hash
     )
-    if not users:
+    if await cache.exists(missing_key):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
+    user = (
+        await queries.execute(
+            db,
+            "authenticate",
+            name=form_data.username,
+            password_hash=password_hash,
+        )
+    ).first()
+    if user is None:
+        await cache.set(missing_key, 1, ex=AUTH_MISSING_TTL)
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
-    [user] = users
     return Token(
         access_token=await create_access_token(
             user_id=user["id"],
-            cache=request.app.state.cache,
+            request=request,
         ),
         token_type="bearer",
     )
 
 
-async def create_access_token(user_id, *, cache: aioredis.Redis):
-    key = random.randbytes(4).hex()
-    await cache.set(f"token_{key}", user_id)
+def _make_user_tokens_key(user_id: int) -> str:
+    return f"user_tokens_{user_id}"
+
+
+async def create_access_token(user_id, *, request: Request):
+    if settings.token_mode == "signed":
+        return request.app.state.tokens.issue(user_id)
+    key = secrets.token_hex(4)
+    # Tokens of a user are listed to revoke them all, the list lives as
+    # long as the latest one.
+    user_tokens_key = _make_user_tokens_key(user_id)
+    pipeline = request.app.state.cache.pipeline(transaction=False)
+    pipeline.set(f"token_{key}", user_id, ex=settings.token_ttl)
+    pipeline.sadd(user_tokens_key, key)
+    pipeline.expire(user_tokens_key, settings.token_ttl)
+    await pipeline.execute()
     return key
+
+
+async def revoke_user_tokens(user_id: int, *, request: Request) -> None:
+    """Revoke all tokens issued to a user so far."""
+    cache = request.app.state.cache
+    if settings.token_mode == "signed":
+        await request.app.state.tokens.revoke_user(user_id, cache=cache)
+        return
+    user_tokens_key = _make_user_tokens_key(user_id)
+    keys = await cache.smembers(user_tokens_key)
+    await cache.delete(
+        user_tokens_key, *(f"token_{key.decode()}" for key in keys)
+    )
+
+
+async def get_current_user_id(
+    request: Request,
+    token: str = Depends(oauth2_scheme),
+) -> int:
+    logger.debug(f"Got token: {token}")
+    if settings.token_mode == "signed":
+        try:
+            return request.app.state.tokens.verify(token)
+        except InvalidToken as e:
+            raise HTTPException(
+                status.HTTP_401_UNAUTHORIZED,
+                "Invalid token",
+                headers={"WWW-Authenticate": "Bearer"},
+            ) from e
+    user_id = await request.app.state.cache.get(f"token_{token}")
+    if user_id is None:
+        raise HTTPException(
+            status.HTTP_401_UNAUTHORIZED,
+            "Invalid token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return int(user_id)
+
+
+@auth_router.delete(
+    "/auth",
+    response_class=Response,
+    status_code=status.HTTP_204_NO_CONTENT,
+)
+async def revoke_access_token(
+    request: Request,
+    token: str = Depends(oauth2_scheme),
+    user_id: int = Depends(get_current_user_id),
+):
+    logger.debug(f"Revoking token of user {user_id}")
+    if settings.token_mode == "signed":
+        await request.app.state.tokens.revoke(
+            token, cache=request.app.state.cache
+        )
+    else:
+        pipeline = request.app.state.cache.pipeline(transaction=False)
+        pipeline.delete(f"token_{token}")
+        pipeline.srem(_make_user_tokens_key(user_id), token)
+        await pipeline.execute()
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import typing as ty
+
+import aioredis
+import sqlalchemy as sa
+from fastapi import FastAPI
+
+from app import models
+from app.core.bloom import (
+    BloomFilter,
+    rebuild_filters,
+)
+from app.core.health import on_warm_up
+from app.core.session import LazyConnection
+from app.settings import settings
+
+REBUILD_CHUNK_SIZE = 10_000
+logger = logging.getLogger(__name__)
+# Ids of active users, names and emails of all users, since deleted users
+# keep their anonymized ones.
+user_id_filter = BloomFilter(
+    "user_id", settings.bloom_capacity, settings.bloom_error_rate
+)
+user_name_filter = BloomFilter(
+    "user_name", settings.bloom_capacity, settings.bloom_error_rate
+)
+user_email_filter = BloomFilter(
+    "user_email", settings.bloom_capacity, settings.bloom_error_rate
+)
+USER_FILTERS = (user_id_filter, user_name_filter, user_email_filter)
+
+
+async def add_users(
+    cache: aioredis.Redis,
+    users: ty.Sequence[tuple[int, str, str]],
+) -> None:
+    """Add ids, names and emails of new users to the filters."""
+    await asyncio.gather(
+        user_id_filter.add(cache, [str(id) for id, _, _ in users]),
+        user_name_filter.add(cache, [name for _, name, _ in users]),
+        user_email_filter.add(cache, [email for _, _, email in users]),
+    )
+
+
+@on_warm_up
+async def rebuild_user_filters(app: FastAPI) -> None:
+    """Build the user filters from the table, if they are missing."""
+    cache = app.state.cache
+    missing = [
+        bloom for bloom in USER_FILTERS if not await bloom.exists(cache)
+    ]
+    if not missing:
+        return
+    # Replicas may lag behind users created during the scan.
+    db = LazyConnection(app.state.db_router.primary, read_only=True)
+    query = sa.select(
+        models.User.id,
+        models.User.name,
+        models.User.email,
+        models.User.deleted_at == None,
+    )
+
+    async def iter_rows() -> ty.AsyncIterator[list[tuple]]:
+        result = await db.stream(query)
+        async for chunk in result.partitions(REBUILD_CHUNK_SIZE):
+            yield [
+                (str(id) if active else None, name, email)
+                for id, name, email, active in chunk
+            ]
+
+    try:
+        if await rebuild_filters(cache, USER_FILTERS, iter_rows):
+            logger.info("Rebuilt user filters")
+    finally:
+        await db.close()
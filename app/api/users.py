@@ -1,33 +1,116 @@
-import base64
+import asyncio
+import functools
 import logging
+import math
+import operator
 import typing as ty
 from datetime import datetime
-from hashlib import sha256
 
+import aioredis
+import asyncpg
+import orjson
 import pydantic as pydantic
 import sqlalchemy as sa
-from cryptography.fernet import Fernet
 from fastapi import (
     APIRouter,
     Depends,
+    FastAPI,
     HTTPException,
+    Query,
     Request,
 )
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.ext.asyncio import AsyncConnection
 from starlette import status
-from starlette.responses import Response
+from starlette.responses import (
+    Response,
+    StreamingResponse,
+)
 
 from app import models
+from app.core import formats
 from app.core.cache import (
+    CacheEntry,
+    LocalCache,
+    bump_generation,
     cached,
+    get_entries,
+    get_generation,
+    get_hot_keys,
+    increment_counter,
+    make_cache_key,
     resets_cache,
+    set_entries,
+    versioned_prefix,
+    writes_cache,
 )
 from app.core.database import utc_now
+from app.core.health import on_warm_up
+from app.core.pagination import (
+    InvalidCursor,
+    decode_cursor,
+    make_link_header,
+)
+from app.core.queries import queries
+from app.core.responses import (
+    encode_rows,
+    is_not_modified,
+    make_cache_control,
+    make_etag,
+    to_timestamp,
+)
+from app.core.session import LazyConnection
+from app.settings import settings
 
-from .auth import oauth2_scheme
+from .auth import (
+    forget_failed_logins,
+    get_current_user_id,
+    revoke_user_tokens,
+)
+from .filters import (
+    add_users,
+    user_email_filter,
+    user_id_filter,
+    user_name_filter,
+)
 
 DEFAULT_LIMIT = 10
+EXPORT_CHUNK_SIZE = 1000
+IMPORT_BATCH_SIZE = 5000
+MAX_BATCH_SIZE = 500
+# Columns are wider, to fit the encrypted values of deleted users.
+MAX_FIELD_LENGTH = 64
+MAX_SEARCH_LIMIT = 100
+# Trigram indexes only help with substrings of three characters and more.
+MIN_SUBSTRING_LENGTH = 3
+# Bump on any change of the cached user representations.
+USER_SCHEMA_VERSION = 1
+USER_CACHE_CONTROL = make_cache_control(
+    settings.user_max_age, settings.user_stale_while_revalidate
+)
+USER_CACHE_PREFIX = versioned_prefix("user", USER_SCHEMA_VERSION)
+USER_CACHE_TTL = 60 * 60
+USER_COUNT_KEY = "user_count"
+# The counter drifts if it fails to change after a commit, so it is
+# recounted once in a while.
+USER_COUNT_TTL = 24 * 60 * 60
+USER_HOT_KEYS_SAMPLE_RATE = 0.01
+USER_INDEX = "ix_user_active_id"
+USER_LIST_CACHE_CONTROL = make_cache_control(
+    settings.user_list_max_age, settings.user_list_stale_while_revalidate
+)
+# List pages are keyed by a generation, bumped on every change of users.
+USER_LIST_PREFIX = "user_list"
+USER_LIST_TTL = 60
+# Short, so that ids probed before they are created expire soon anyway.
+USER_MISSING_TTL = 30
+# Search results are keyed by a generation too, bumped when users that
+# could be found are renamed or removed.
+USER_SEARCH_PREFIX = versioned_prefix("user_search", USER_SCHEMA_VERSION)
+USER_SEARCH_TTL = 60
+# Long enough for any read that started before a deletion to finish.
+USER_TOMBSTONE_TTL = 60
+USER_TOTAL_TTL = 30
 logger = logging.getLogger(__name__)
 users_router = APIRouter(prefix="/users")
 
@@ -41,14 +124,14 @@ class User(pydantic.BaseModel):
 
 
 class UserCreateInfo(pydantic.BaseModel):
-    name: str
-    email: str
+    name: str = pydantic.Field(..., max_length=MAX_FIELD_LENGTH)
+    email: str = pydantic.Field(..., max_length=MAX_FIELD_LENGTH)
     password: str
 
 
 class UserUpdateInfo(pydantic.BaseModel):
-    name: ty.Optional[str]
-    email: ty.Optional[str]
+    name: ty.Optional[str] = pydantic.Field(None, max_length=MAX_FIELD_LENGTH)
+    email: ty.Optional[str] = pydantic.Field(None, max_length=MAX_FIELD_LENGTH)
     password: ty.Optional[str]
 
 
@@ -57,56 +140,644 @@ class UserInList(pydantic.BaseModel):
     name: str
 
 
+class UserLookup(pydantic.BaseModel):
+    id: int
+    found: bool
+    user: User | None
+
+
+class UserSearchResult(pydantic.BaseModel):
+    __root__: list[User]
+
+
+class BulkImportError(pydantic.BaseModel):
+    row: int
+    reason: str
+
+
+class BulkImportResult(pydantic.BaseModel):
+    created: int
+    errors: list[BulkImportError]
+
+
+USER_IN_LIST_FIELDS = tuple(UserInList.__fields__)
+
+
+def _change_user_count(request: Request, amount: int) -> None:
+    """Change the user counter once the request's changes commit."""
+    request.state.db.on_commit(
+        functools.partial(
+            increment_counter,
+            request.app.state.cache,
+            USER_COUNT_KEY,
+            amount,
+        )
+    )
+
+
+def _reset_user_list(request: Request) -> None:
+    """Drop all cached list pages once the request's changes commit."""
+    request.state.db.on_commit(
+        functools.partial(
+            bump_generation,
+            request.app.state.cache,
+            USER_LIST_PREFIX,
+            request.app.state.local_cache,
+        )
+    )
+
+
+async def _add_to_filters(
+    request: Request,
+    users: list[tuple[int, str, str]],
+) -> None:
+    """Add users to the filters now, and again once committed.
+
+    Failing to add them fails the request, rather than committing users
+    the filters miss. A value added for a transaction rolled back only
+    costs a lookup. The second add reaches filters that a rebuild swapped
+    in meanwhile, from a scan that could not see the uncommitted rows.
+    """
+    cache = request.app.state.cache
+    await add_users(cache, users)
+    request.state.db.on_commit(functools.partial(add_users, cache, users))
+
+
+def _reset_user_search(request: Request) -> None:
+    """Drop all cached search results once the request's changes commit."""
+    request.state.db.on_commit(
+        functools.partial(
+            bump_generation,
+            request.app.state.cache,
+            USER_SEARCH_PREFIX,
+            request.app.state.local_cache,
+        )
+    )
+
+
+queries.register(
+    "create_user",
+    sa.insert(models.User)
+    .values(
+        name=sa.bindparam("name"),
+        email=sa.bindparam("email"),
+        password_hash=sa.bindparam("password_hash"),
+    )
+    .returning(*models.User.__table__.c),
+)
+queries.register(
+    "read_user",
+    sa.select(models.User).where(
+        (models.User.id == sa.bindparam("id"))
+        & (models.User.deleted_at == None)
+    ),
+    warm_up={"id": 0},
+)
+queries.register(
+    "find_user_by_name_or_email",
+    # Deleted users keep their anonymized names and emails.
+    sa.select(models.User.id)
+    .where(
+        (models.User.name == sa.bindparam("name"))
+        | (models.User.email == sa.bindparam("email"))
+    )
+    .limit(1),
+)
+queries.register(
+    "read_users",
+    sa.select(models.User).where(
+        (
+            models.User.id
+            == sa.any_(sa.bindparam("ids", type_=postgresql.ARRAY(sa.Integer)))
+        )
+        & (models.User.deleted_at == None)
+    ),
+    warm_up={"ids": []},
+)
+queries.register(
+    "count_users",
+    sa.select(sa.func.count())
+    .select_from(models.User)
+    .where(models.User.deleted_at == None),
+)
+queries.register(
+    "estimate_users",
+    # The partial index holds only active users.
+    sa.text(
+        "SELECT reltuples::bigint FROM pg_class "
+        "WHERE oid = to_regclass(:index)"
+    ),
+)
+queries.register(
+    "list_users",
+    sa.select(models.User)
+    .where(models.User.deleted_at == None)
+    .order_by(models.User.id)
+    .limit(sa.bindparam("limit"))
+    .offset(sa.bindparam("offset")),
+    warm_up={"limit": 0, "offset": 0},
+)
+queries.register(
+    "list_users_after",
+    sa.select(models.User)
+    .where(
+        (models.User.id > sa.bindparam("cursor"))
+        & (models.User.deleted_at == None)
+    )
+    .order_by(models.User.id)
+    .limit(sa.bindparam("limit")),
+    warm_up={"cursor": 0, "limit": 0},
+)
+queries.register(
+    "list_users_before",
+    sa.select(models.User)
+    .where(
+        (models.User.id < sa.bindparam("cursor"))
+        & (models.User.deleted_at == None)
+    )
+    .order_by(sa.desc(models.User.id))
+    .limit(sa.bindparam("limit")),
+    warm_up={"cursor": 0, "limit": 0},
+)
+
+user_import = sa.Table(
+    "user_import",
+    sa.MetaData(),
+    sa.Column("row_no", sa.Integer, nullable=False),
+    sa.Column("name", sa.String(length=MAX_FIELD_LENGTH), nullable=False),
+    sa.Column("email", sa.String(length=MAX_FIELD_LENGTH), nullable=False),
+    sa.Column(
+        "password_hash", sa.String(length=MAX_FIELD_LENGTH), nullable=False
+    ),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+async def _cache_users(
+    cache: aioredis.Redis,
+    users: ty.Iterable[User],
+    nx: bool = False,
+) -> dict[str, CacheEntry]:
+    """Store users as `read_user` caches them, in one pipeline.
+
+    Returns the stored entries.
+    """
+    entries = {
+        make_cache_key(USER_CACHE_PREFIX, id=user.id): CacheEntry(
+            user.json().encode(),
+            last_modified=to_timestamp(user.updated_at),
+        )
+        for user in users
+    }
+    if not entries:
+        return entries
+    stored = await set_entries(cache, entries, ttl=USER_CACHE_TTL, nx=nx)
+    return {
+        key: entry
+        for (key, entry), is_stored in zip(entries.items(), stored)
+        if is_stored
+    }
+
+
+async def _forget_missing_users(
+    cache: aioredis.Redis,
+    users: list[tuple[int, str, str]],
+) -> None:
+    # Ids probed before they existed may be cached as missing.
+    for i in range(0, len(users), IMPORT_BATCH_SIZE):
+        await cache.delete(
+            *[
+                make_cache_key(USER_CACHE_PREFIX, id=id)
+                for id, _, _ in users[i : i + IMPORT_BATCH_SIZE]
+            ]
+        )
+
+
+async def _is_taken(
+    db: LazyConnection,
+    cache: aioredis.Redis,
+    name: str | None,
+    email: str | None,
+) -> bool:
+    """Look a name and an email up, unless filters tell they are unused."""
+    if not name or not email:
+        return False
+    [name_used], [email_used] = await asyncio.gather(
+        user_name_filter.might_contain(cache, [name]),
+        user_email_filter.might_contain(cache, [email]),
+    )
+    if not name_used and not email_used:
+        return False
+    user = (
+        await queries.execute(
+            db, "find_user_by_name_or_email", name=name, email=email
+        )
+    ).first()
+    return user is not None
+
+
 @users_router.post(
     "/",
     response_model=User,
     status_code=status.HTTP_201_CREATED,
 )
 async def create_user(request: Request, user_info: UserUpdateInfo):
+    """Create a user with a unique name and email.
+
+    Collisions are looked up before the password is hashed, unless the
+    name and email filters tell the values are surely unused.
+    """
     logger.debug(f"Got request: {user_info}")
     db = request.state.db
-    # TODO: Check if name and email fit in 32 chars. And other checks.
+    cache = request.app.state.cache
+    if await _is_taken(db, cache, user_info.name, user_info.email):
+        raise HTTPException(400, "This name or email already exists")
+    password_hash = await request.app.state.crypto.hash_password(
+        user_info.password
+    )
     try:
-        [user] = await db.execute(
-            sa.insert(models.User)
-            .values(
-                name=user_info.name,
-                email=user_info.email,
-                password_hash=sha256(user_info.password.encode()).hexdigest(),
-            )
-            .returning(*models.User.__table__.c)
+        [user] = await queries.execute(
+            db,
+            "create_user",
+            name=user_info.name,
+            email=user_info.email,
+            password_hash=password_hash,
         )
     except IntegrityError as e:
         raise HTTPException(400, "This name or email already exists") from e
-    return User(**user)
+    new_user = User(**user)
+    await _add_to_filters(
+        request, [(new_user.id, new_user.name, new_user.email)]
+    )
+    _change_user_count(request, 1)
+    _reset_user_list(request)
+    forget_failed_logins(request)
+    # Overwrites the user if the id was probed and cached as missing.
+    db.on_commit(functools.partial(_cache_users, cache, [new_user]))
+    return new_user
+
+
+def _check_import_record(record: formats.Record | None) -> str | None:
+    if record is None:
+        return "Malformed record"
+    for key in ["name", "email", "password"]:
+        value = record.get(key)
+        if not isinstance(value, str) or not value:
+            return f"Missing {key}"
+        if key != "password" and len(value) > MAX_FIELD_LENGTH:
+            return f"Too long {key}"
+    return None
+
+
+@users_router.post("/bulk", response_model=BulkImportResult)
+async def import_users(request: Request):
+    """Create users from a streamed NDJSON or CSV body.
+
+    Records need `name`, `email` and `password`. They are copied into a
+    temporary staging table with `COPY` batch by batch and merged into the
+    users table by a single statement. Records colliding on name or email
+    with existing users or with earlier records are skipped and reported.
+    A record the database rejects fails the whole import.
+    """
+    media_type = request.headers.get("content-type", "").partition(";")[0]
+    if media_type not in formats.MEDIA_TYPES:
+        raise HTTPException(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            f"Expected one of: {', '.join(formats.MEDIA_TYPES)}",
+        )
+    db: LazyConnection = request.state.db
+    await db.execute(sa.schema.CreateTable(user_import))
+    connection = (await db.get_raw_connection()).driver_connection
+    crypto = request.app.state.crypto
+    errors = []
+    staged: list[tuple[int, str, str]] = []
+    async for batch in formats.iter_record_batches(
+        request.stream(), media_type, batch_size=IMPORT_BATCH_SIZE
+    ):
+        valid = []
+        passwords = []
+        for row_no, record in batch:
+            reason = _check_import_record(record)
+            if reason is None:
+                assert record is not None
+                valid.append((row_no, record["name"], record["email"]))
+                passwords.append(record["password"])
+            else:
+                errors.append(BulkImportError(row=row_no, reason=reason))
+        password_hashes = await crypto.hash_passwords(passwords)
+        try:
+            await connection.copy_records_to_table(
+                user_import.name,
+                records=[
+                    (*row, password_hash)
+                    for row, password_hash in zip(valid, password_hashes)
+                ],
+                columns=[column.name for column in user_import.c],
+            )
+        except asyncpg.DataError as e:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST,
+                f"Malformed record in rows {batch[0][0]} to {batch[-1][0]}",
+            ) from e
+        staged.extend(valid)
+
+    now = utc_now()
+    created_users = (
+        await db.execute(
+            postgresql.insert(models.User)
+            .from_select(
+                ["name", "email", "password_hash", "created_at", "updated_at"],
+                sa.select(
+                    user_import.c.name,
+                    user_import.c.email,
+                    user_import.c.password_hash,
+                    sa.literal(now),
+                    sa.literal(now),
+                ).order_by(user_import.c.row_no),
+            )
+            .on_conflict_do_nothing()
+            .returning(models.User.id, models.User.name, models.User.email)
+        )
+    ).all()
+    created = {(name, email) for _, name, email in created_users}
+    created_count = len(created)
+    for row_no, name, email in staged:
+        if (name, email) in created:
+            created.remove((name, email))
+        else:
+            errors.append(
+                BulkImportError(row=row_no, reason="Name or email exists")
+            )
+    errors.sort(key=lambda error: error.row)
+    if created_count:
+        await _add_to_filters(request, created_users)
+        _change_user_count(request, created_count)
+        _reset_user_list(request)
+        forget_failed_logins(request)
+        db.on_commit(
+            functools.partial(
+                _forget_missing_users, request.app.state.cache, created_users
+            )
+        )
+    return BulkImportResult(created=created_count, errors=errors)
+
+
+@users_router.get(
+    "/export",
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "content": {media_type: {} for media_type in formats.MEDIA_TYPES}
+        }
+    },
+)
+async def export_users(
+    request: Request,
+    format_: ty.Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+):
+    """Stream all active users as NDJSON or CSV.
+
+    Rows are read through a server-side cursor and encoded chunk by chunk,
+    so memory use does not depend on the table size.
+    """
+    db: LazyConnection = request.state.db
+    columns = list(User.__fields__)
+    query = (
+        sa.select(*[models.User.__table__.c[column] for column in columns])
+        .where(models.User.deleted_at == None)
+        .order_by(models.User.id)
+    )
+
+    async def encode_users() -> ty.AsyncIterator[bytes]:
+        if format_ == "csv":
+            yield formats.encode_csv_header(columns)
+        result = await db.stream(query)
+        async for chunk in result.mappings().partitions(EXPORT_CHUNK_SIZE):
+            if format_ == "csv":
+                yield formats.encode_csv(chunk, columns)
+            else:
+                yield formats.encode_ndjson(chunk)
+
+    return StreamingResponse(
+        encode_users(), media_type=formats.FORMATS[format_]
+    )
+
+
+def _parse_ids(ids: list[str]) -> list[int]:
+    try:
+        return [int(id) for value in ids for id in value.split(",") if id]
+    except ValueError as e:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, "Ids must be integers"
+        ) from e
+
+
+async def _fetch_users(
+    db: LazyConnection,
+    cache: aioredis.Redis,
+    ids: list[int],
+    local_cache: LocalCache | None = None,
+) -> dict[int, User]:
+    """Read users from the DB and cache them in one pipeline.
+
+    Ids the filter knows nothing about are not looked up.
+    """
+    maybe = await user_id_filter.might_contain(cache, [str(id) for id in ids])
+    ids = [id for id, exists in zip(ids, maybe) if exists]
+    if not ids:
+        return {}
+    rows = await queries.execute(db, "read_users", ids=ids)
+    users = {row["id"]: User(**row) for row in rows}
+    entries = await _cache_users(cache, users.values(), nx=True)
+    if local_cache is not None:
+        for key, entry in entries.items():
+            local_cache.set(key, entry)
+    return users
+
+
+@users_router.get("/batch", response_model=list[UserLookup])
+async def read_users(request: Request, ids: list[str] = Query(...)):
+    """Look up many users by ids, given as `ids=1,2,3` or `ids=1&ids=2`.
+
+    Cached users are taken with a single `MGET`, the rest with a single
+    query, and cached in one pipeline. Results follow the order of ids.
+    """
+    user_ids = _parse_ids(ids)
+    if len(user_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"At most {MAX_BATCH_SIZE} ids are allowed",
+        )
+    unique_ids = list(dict.fromkeys(user_ids))
+    keys = [make_cache_key(USER_CACHE_PREFIX, id=id) for id in unique_ids]
+    cache = request.app.state.cache
+    local_cache = request.app.state.local_cache
+    entries = await get_entries(cache, keys, local_cache)
+    users = {
+        id: User.parse_raw(entry.decompressed())
+        for id, entry in zip(unique_ids, entries)
+        if entry is not None
+    }
+
+    missing_ids = [id for id in unique_ids if id not in users]
+    if missing_ids:
+        users.update(
+            await _fetch_users(
+                request.state.db, cache, missing_ids, local_cache
+            )
+        )
+
+    return [
+        UserLookup(id=id, found=id in users, user=users.get(id))
+        for id in user_ids
+    ]
+
+
+@on_warm_up
+async def warm_up_user_cache(app: FastAPI) -> None:
+    """Load the most read users into the caches of a fresh worker."""
+    if settings.warm_up_hot_users <= 0:
+        return
+    cache = app.state.cache
+    keys = await get_hot_keys(
+        cache, USER_CACHE_PREFIX, settings.warm_up_hot_users
+    )
+    entries = await get_entries(cache, keys, app.state.local_cache)
+    missing_ids = [
+        int(key.rpartition("_")[2])
+        for key, entry in zip(keys, entries)
+        if entry is None
+    ]
+    if not missing_ids:
+        return
+    db = LazyConnection(app.state.db_router.for_read(), read_only=True)
+    try:
+        await _fetch_users(db, cache, missing_ids, app.state.local_cache)
+    finally:
+        await db.close()
+    logger.info(f"Loaded {len(keys)} hot users into the cache")
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _search_condition(
+    q: str,
+    match: ty.Literal["prefix", "substring"],
+) -> sa.sql.ColumnElement:
+    # Patterns are bound, so every search shares a prepared statement.
+    # PostgreSQL plans it for each pattern anyway, as a generic plan could
+    # not use the indexes.
+    columns = models.User.__table__.c
+    if match == "prefix":
+        pattern = sa.bindparam("pattern", _escape_like(q.lower()) + "%")
+        name = sa.func.lower(columns.name)
+        email = sa.func.lower(columns.email)
+        return name.like(pattern) | email.like(pattern)
+    pattern = sa.bindparam("pattern", f"%{_escape_like(q)}%")
+    return columns.name.ilike(pattern) | columns.email.ilike(pattern)
+
+
+@users_router.get("/search", response_model=list[User])
+async def search_users(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=MAX_FIELD_LENGTH),
+    match: ty.Literal["prefix", "substring"] = "prefix",
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+):
+    """Find active users by name or email, ignoring case.
+
+    A `prefix` match is served by `text_pattern_ops` indexes, a `substring`
+    one, which needs at least three characters, by trigram indexes.
+    Results are ordered by id and cached for a minute, or until a user is
+    renamed or removed.
+    """
+    if match == "substring" and len(q) < MIN_SUBSTRING_LENGTH:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"Substrings need at least {MIN_SUBSTRING_LENGTH} characters",
+        )
+    generation = await get_generation(
+        request.app.state.cache,
+        USER_SEARCH_PREFIX,
+        request.app.state.local_cache,
+    )
+    return await _search_users(
+        request=request, q=q, match=match, limit=limit, generation=generation
+    )
+
+
+@cached(
+    prefix=USER_SEARCH_PREFIX,
+    significant_args=["q", "match", "limit", "generation"],
+    local=True,
+    ttl=USER_SEARCH_TTL,
+    raw=True,
+)
+async def _search_users(
+    request: Request,
+    q: str,
+    match: ty.Literal["prefix", "substring"],
+    limit: int,
+    generation: int,
+):
+    db: LazyConnection = request.state.db
+    rows = await db.execute(
+        sa.select(models.User)
+        .where(_search_condition(q, match) & (models.User.deleted_at == None))
+        .order_by(models.User.id)
+        .limit(limit)
+    )
+    return UserSearchResult.parse_obj([User(**row) for row in rows])
 
 
 @users_router.get("/{id}", response_model=User)
-@cached(prefix="user", significant_args=["id"])
+@cached(
+    prefix=USER_CACHE_PREFIX,
+    significant_args=["id"],
+    local=True,
+    ttl=USER_CACHE_TTL,
+    early_refresh=1.0,
+    negative_ttl=USER_MISSING_TTL,
+    raw=True,
+    hot_keys_sample_rate=USER_HOT_KEYS_SAMPLE_RATE,
+    last_modified=operator.attrgetter("updated_at"),
+    cache_control=USER_CACHE_CONTROL,
+)
 async def read_user(request: Request, id: int):
-    db: AsyncConnection = request.state.db
-    users = await db.execute(
-        sa.select(models.User).where(
-            (models.User.id == id) & (models.User.deleted_at == None)
-        )
+    """Read an active user.
+
+    Missing users are cached for a while, ids the filter knows nothing
+    about are not even looked up.
+    """
+    [maybe] = await user_id_filter.might_contain(
+        request.app.state.cache, [str(id)]
     )
-    if not users:
+    if not maybe:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
+    db: LazyConnection = request.state.db
+    user = (await queries.execute(db, "read_user", id=id)).first()
+    if user is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
-    [user] = users
     return User(**user)
 
 
 @users_router.patch("/{id}", response_model=User)
-@resets_cache(prefix="user", significant_args=["id"])
+@writes_cache(
+    prefix=USER_CACHE_PREFIX,
+    significant_args=["id"],
+    ttl=USER_CACHE_TTL,
+    last_modified=operator.attrgetter("updated_at"),
+)
 async def update_user(
     request: Request,
     id: int,
     user_info: UserUpdateInfo,
-    token: str = Depends(oauth2_scheme),
+    user_id: int = Depends(get_current_user_id),
 ):
     logger.debug(f"Got request: {user_info}")
-    logger.debug(f"Got token: {token}")
-    user_id = int(await request.app.state.cache.get(f"token_{token}"))
     logger.debug(f"Got user_id: {user_id}")
     if user_id != id:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
@@ -117,16 +788,34 @@ async def update_user(
         if getattr(user_info, key)
     }
     if user_info.password:
-        to_update["password_hash"] = sha256(
-            user_info.password.encode()
-        ).hexdigest()
-    [user] = await db.execute(
-        sa.update(models.User)
-        .where(models.User.id == int(id))
-        .values(**to_update)
-        .returning(*models.User.__table__.c)
-    )
-    return User(**user)
+        password_hash = await request.app.state.crypto.hash_password(
+            user_info.password
+        )
+        to_update["password_hash"] = password_hash
+    # A deleted user's token may still be valid, the row must not change.
+    user = (
+        await db.execute(
+            sa.update(models.User)
+            .where((models.User.id == id) & (models.User.deleted_at == None))
+            .values(**to_update)
+            .returning(*models.User.__table__.c)
+        )
+    ).first()
+    if user is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
+    if "name" in to_update:
+        _reset_user_list(request)
+    if "name" in to_update or "email" in to_update:
+        _reset_user_search(request)
+    if "name" in to_update or "password_hash" in to_update:
+        forget_failed_logins(request)
+    updated_user = User(**user)
+    if "name" in to_update or "email" in to_update:
+        await _add_to_filters(
+            request,
+            [(updated_user.id, updated_user.name, updated_user.email)],
+        )
+    return updated_user
 
 
 @users_router.delete(
@@ -134,38 +823,132 @@ async def update_user(
     response_class=Response,
     status_code=status.HTTP_204_NO_CONTENT,
 )
-@resets_cache(prefix="user", significant_args=["id"])
+@resets_cache(
+    prefix=USER_CACHE_PREFIX,
+    significant_args=["id"],
+    tombstone_ttl=USER_TOMBSTONE_TTL,
+    tombstone_detail="User not found",
+)
 async def delete_user(
     request: Request,
     id: int,
-    token: str = Depends(oauth2_scheme),
+    user_id: int = Depends(get_current_user_id),
 ):
-    user_id = int(await request.app.state.cache.get(f"token_{token}"))
     if user_id != id:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
     db = request.state.db
-    users = await db.execute(
-        sa.select(models.User)
-        .with_for_update()
-        .where((models.User.id == id) & (models.User.deleted_at == None))
-    )
-    if not users:
+    user = (
+        await db.execute(
+            sa.select(models.User)
+            .with_for_update()
+            .where((models.User.id == id) & (models.User.deleted_at == None))
+        )
+    ).first()
+    if user is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
-    [user] = users
-    password_hash = user["password_hash"]
-    fernet = Fernet(key=base64.b64encode(bytes.fromhex(password_hash)))
     # Unreadable data are still recoverable with password.
     # TODO: Add a recovery endpoint.
+    name, email = await request.app.state.crypto.anonymize(
+        user["password_hash"], user["name"], user["email"]
+    )
     await db.execute(
         sa.update(models.User)
         .where(models.User.id == id)
         .values(
             deleted_at=utc_now(),
-            name=fernet.encrypt(user["name"].encode()).hex(),
-            email=fernet.encrypt(user["email"].encode()).hex(),
+            name=name,
+            email=email,
             password_hash="",
         )
     )
+    await revoke_user_tokens(id, request=request)
+    _change_user_count(request, -1)
+    _reset_user_list(request)
+    _reset_user_search(request)
+
+
+async def _count_exact(db: LazyConnection) -> int:
+    return (await queries.execute(db, "count_users")).scalar_one()
+
+
+async def _count_users(
+    request: Request,
+    strategy: ty.Literal["exact", "counter", "estimate"],
+) -> int:
+    cache = request.app.state.cache
+    db: LazyConnection = request.state.db
+    if strategy == "counter":
+        total = await cache.get(USER_COUNT_KEY)
+        if total is None:
+            # The counter is kept for long, don't seed it from a replica
+            # lagging behind changes it will count.
+            primary = LazyConnection(
+                request.app.state.db_router.primary, read_only=True
+            )
+            try:
+                total = await _count_exact(primary)
+            finally:
+                await primary.close()
+            await cache.set(USER_COUNT_KEY, total, ex=USER_COUNT_TTL, nx=True)
+        return int(total)
+
+    cache_key = make_cache_key("user_total", strategy=strategy)
+    total = await cache.get(cache_key)
+    if total is None:
+        if strategy == "estimate":
+            total = (
+                await queries.execute(db, "estimate_users", index=USER_INDEX)
+            ).scalar()
+            # Indexes of never analyzed tables estimate them empty or have
+            # no estimate, count with the counter instead.
+            if total is None or total <= 0:
+                return await _count_users(request, "counter")
+        else:
+            total = await _count_exact(db)
+        await cache.set(cache_key, total, ex=USER_TOTAL_TTL)
+    return int(total)
+
+
+async def _list_users(
+    db: LazyConnection,
+    limit: int,
+    offset: int,
+    after: str | None,
+    before: str | None,
+) -> tuple[list[ty.Mapping[str, ty.Any]], bool]:
+    """Read a page of users, telling if more follow in the read direction.
+
+    One more row than the page holds is read to find out.
+    """
+    try:
+        if after is not None:
+            rows = await queries.execute(
+                db,
+                "list_users_after",
+                cursor=decode_cursor(after),
+                limit=limit + 1,
+            )
+        elif before is not None:
+            rows = await queries.execute(
+                db,
+                "list_users_before",
+                cursor=decode_cursor(before),
+                limit=limit + 1,
+            )
+        else:
+            rows = await queries.execute(
+                db, "list_users", limit=limit + 1, offset=offset
+            )
+    except InvalidCursor as e:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, "Invalid cursor"
+        ) from e
+    users = rows.all()
+    has_more = len(users) > limit
+    del users[limit:]
+    if before is not None:
+        users.reverse()
+    return users, has_more
 
 
 @users_router.get("/", response_model=list[UserInList])
@@ -173,12 +956,88 @@ async def list_users(
     request: Request,
     limit: int = DEFAULT_LIMIT,
     offset: int = 0,
+    after: str | None = None,
+    before: str | None = None,
+    total: ty.Literal["exact", "counter", "estimate"] | None = None,
 ):
-    db: AsyncConnection = request.state.db
-    users = await db.execute(
-        sa.select(models.User)
-        .where(models.User.deleted_at == None)
-        .limit(limit if limit > 0 else DEFAULT_LIMIT)
-        .offset(max(offset, 0))
+    """List active users.
+
+    Pages either by `offset` (kept for compatibility) or by the opaque
+    `after`/`before` cursors. Cursor pages are served from the partial
+    index on active ids, so a deep page costs the same as the first one.
+    Links to neighbouring pages are returned in the `Link` header.
+
+    With `total`, the number of active users and pages is returned in the
+    `X-Total-Count` and `X-Page-Count` headers. It is counted `exact`ly,
+    kept by a `counter` updated on every change, or `estimate`d from the
+    table statistics. Exact and estimated totals are cached for a while.
+
+    Pages are cached for a minute under the current generation of the
+    list, so any change of users drops all of them at once. Requests
+    whose `If-None-Match` matches the cached page get `304`. Pages have no
+    `Last-Modified`: removed users change them too.
+    """
+    if after is not None and before is not None:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, "Use either `after` or `before`"
+        )
+    limit = limit if limit > 0 else DEFAULT_LIMIT
+    offset = max(offset, 0)
+    cache = request.app.state.cache
+    local_cache = request.app.state.local_cache
+    generation = await get_generation(cache, USER_LIST_PREFIX, local_cache)
+    cache_key = make_cache_key(
+        versioned_prefix(USER_LIST_PREFIX, USER_SCHEMA_VERSION, generation),
+        limit=limit,
+        offset=offset,
+        after=after,
+        before=before,
     )
-    return [UserInList(**user) for user in users]
+    # Whether more users follow the page is kept next to it.
+    more_key = f"{cache_key}_more"
+    entry, more = await get_entries(cache, [cache_key, more_key], local_cache)
+    if entry is None or more is None:
+        users, has_more = await _list_users(
+            request.state.db, limit, offset, after, before
+        )
+        entry = CacheEntry(encode_rows(users, USER_IN_LIST_FIELDS))
+        more = CacheEntry(orjson.dumps(has_more))
+        await set_entries(
+            cache, {cache_key: entry, more_key: more}, ttl=USER_LIST_TTL
+        )
+        if local_cache is not None:
+            local_cache.set(cache_key, entry)
+            local_cache.set(more_key, more)
+    else:
+        users = orjson.loads(entry.body)
+        has_more = orjson.loads(more.body)
+
+    headers = {"Cache-Control": USER_LIST_CACHE_CONTROL}
+    if users:
+        link = make_link_header(
+            request.url,
+            first_id=users[0]["id"],
+            last_id=users[-1]["id"],
+            has_next=has_more or before is not None,
+            has_previous=(
+                has_more
+                if before is not None
+                else after is not None or offset > 0
+            ),
+        )
+        if link:
+            headers["Link"] = link
+    if total is None:
+        etag = make_etag(entry.digest)
+    else:
+        total_count = await _count_users(request, total)
+        headers["X-Total-Count"] = str(total_count)
+        headers["X-Page-Count"] = str(math.ceil(total_count / limit))
+        # Totals change without the page.
+        etag = make_etag(entry.digest, str(total_count))
+    headers["ETag"] = etag
+    if is_not_modified(request.headers, etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+        )
+    return Response(entry.body, media_type="application/json", headers=headers)
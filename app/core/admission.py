@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import math
+import time
+
+import aioredis
+from starlette import status
+from starlette.responses import JSONResponse
+from starlette.types import (
+    ASGIApp,
+    Receive,
+    Scope,
+    Send,
+)
+
+from app.core import metrics
+from app.core.session import READ_ONLY_METHODS
+
+AUTH_PATH = "/api/auth"
+EXEMPT_PATHS = ("/health/", "/metrics")
+# Refills a client's bucket for the elapsed time and takes a token from
+# it. Returns whether a token was taken and, if not, seconds to wait.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("hmget", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("hset", KEYS[1], "tokens", tostring(tokens), "updated_at", now)
+redis.call("pexpire", KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(wait)}
+"""
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Limiter:
+    """Concurrency limit with a bounded queue and a queue deadline.
+
+    Up to `limit` requests run at once. Up to `max_queue` more wait for
+    at most `queue_timeout` seconds. Others are rejected right away, so an
+    overloaded server answers fast instead of timing out.
+    """
+
+    def __init__(
+        self,
+        route_class: str,
+        limit: int,
+        max_queue: int,
+        queue_timeout: float,
+        retry_after: float,
+    ):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limit)
+        self._queue_depth = metrics.ADMISSION_QUEUE_DEPTH.labels(route_class)
+        self._in_flight = metrics.ADMISSION_IN_FLIGHT.labels(route_class)
+        self._queue_full = metrics.ADMISSION_SHED.labels(
+            route_class, "queue_full"
+        )
+        self._timed_out = metrics.ADMISSION_SHED.labels(
+            route_class, "queue_timeout"
+        )
+
+    def _reject(self) -> Rejected:
+        return Rejected(
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            "Server is busy",
+            self.retry_after,
+        )
+
+    async def acquire(self) -> None:
+        if not self._slots.locked():
+            await self._slots.acquire()
+        elif self.waiting >= self.max_queue:
+            self._queue_full.inc()
+            raise self._reject()
+        else:
+            self.waiting += 1
+            self._queue_depth.inc()
+            try:
+                await asyncio.wait_for(
+                    self._slots.acquire(), self.queue_timeout
+                )
+            except asyncio.TimeoutError:
+                self._timed_out.inc()
+                raise self._reject() from None
+            finally:
+                self.waiting -= 1
+                self._queue_depth.dec()
+        self._in_flight.inc()
+
+    def release(self) -> None:
+        self._in_flight.dec()
+        self._slots.release()
+
+
+class TokenBucket:
+    """Per-client rate limit shared by all workers through Redis.
+
+    Clients get `burst` requests at once and `rate` more every second.
+    If Redis is unavailable, requests are let through.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._rate_limited = metrics.ADMISSION_SHED.labels(
+            name, "rate_limited"
+        )
+
+    async def take(self, cache: aioredis.Redis, client: str) -> None:
+        try:
+            allowed, wait = await cache.eval(
+                TOKEN_BUCKET_SCRIPT,
+                1,
+                f"rate_limit_{self.name}_{client}",
+                self.burst,
+                self.rate,
+                time.time(),
+            )
+        except (aioredis.ConnectionError, aioredis.TimeoutError) as e:
+            logger.warning(f"Failed to check rate limit: {e}")
+            return
+        if not allowed:
+            self._rate_limited.inc()
+            raise Rejected(
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                "Too many requests",
+                float(wait),
+            )
+
+
+def get_route_class(scope: Scope) -> str | None:
+    path = scope["path"]
+    if path.startswith(EXEMPT_PATHS):
+        return None
+    if path.startswith(AUTH_PATH):
+        return "auth"
+    return "read" if scope["method"] in READ_ONLY_METHODS else "write"
+
+
+class AdmissionMiddleware:
+    """Shed load before it queues up on the DB pool.
+
+    Requests are classified as reads, writes or authentication, and every
+    class has its own `Limiter`, so slow writes do not starve reads.
+    Authentication is also rate limited per client by a `TokenBucket`.
+    Rejected requests get `503` or `429` with `Retry-After`.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        limits: dict[str, int],
+        max_queue: int,
+        queue_timeout: float,
+        retry_after: float,
+        auth_rate: float = 0.0,
+        auth_burst: int = 0,
+    ):
+        self.app = app
+        self.limiters = {
+            route_class: Limiter(
+                route_class,
+                limit=limit,
+                max_queue=max_queue,
+                queue_timeout=queue_timeout,
+                retry_after=retry_after,
+            )
+            for route_class, limit in limits.items()
+            if limit > 0
+        }
+        self.auth_bucket = (
+            TokenBucket("auth", rate=auth_rate, burst=auth_burst)
+            if auth_rate > 0
+            else None
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        route_class = (
+            get_route_class(scope) if scope["type"] == "http" else None
+        )
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiters.get(route_class)
+        try:
+            if route_class == "auth" and self.auth_bucket is not None:
+                client = scope["client"][0] if scope.get("client") else ""
+                await self.auth_bucket.take(scope["app"].state.cache, client)
+            if limiter is not None:
+                await limiter.acquire()
+        except Rejected as e:
+            response = JSONResponse(
+                {"detail": e.detail},
+                status_code=e.status_code,
+                headers={"Retry-After": str(math.ceil(e.retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if limiter is not None:
+                limiter.release()
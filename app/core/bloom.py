@@ -0,0 +1,153 @@
+import hashlib
+import math
+import secrets
+import typing as ty
+
+import aioredis
+
+from app.core import metrics
+from app.core.cache import UNLOCK_SCRIPT
+
+# Sets bits in every filter of KEYS that exists. A filter being rebuilt
+# exists under a second key, so values added meanwhile land in both.
+ADD_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call("exists", key) == 1 then
+        for i = 1, #ARGV do
+            redis.call("setbit", key, ARGV[i], 1)
+        end
+    end
+end
+"""
+# Tells whether all bits are set. A missing filter may contain anything.
+CHECK_SCRIPT = """
+if redis.call("exists", KEYS[1]) == 0 then
+    return 1
+end
+for i = 1, #ARGV do
+    if redis.call("getbit", KEYS[1], ARGV[i]) == 0 then
+        return 0
+    end
+end
+return 1
+"""
+REBUILD_LOCK_TIMEOUT = 10 * 60
+
+
+class BloomFilter:
+    """Set membership test kept as a Redis bitmap, shared by all workers.
+
+    `might_contain` never misses a value that was added, but may take a
+    value that was not for one with about `error_rate` probability, so it
+    tells definite misses apart without a query. Values cannot be
+    removed, the filter is rebuilt from the source of truth instead.
+
+    The key embeds the size of the filter, so changing the capacity or the
+    error rate starts a new, missing filter. Until it is rebuilt, every
+    value might be contained.
+    """
+
+    def __init__(self, name: str, capacity: int, error_rate: float):
+        self.enabled = capacity > 0
+        self.size = max(
+            math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 8
+        )
+        self.hashes = max(round(self.size / max(capacity, 1) * math.log(2)), 1)
+        self.key = f"bloom_{name}_{self.size}_{self.hashes}"
+        self.building_key = f"{self.key}_building"
+        self._absent = metrics.BLOOM_CHECKS.labels(name, "absent")
+        self._maybe = metrics.BLOOM_CHECKS.labels(name, "maybe")
+
+    def positions(self, value: str) -> list[int]:
+        # Double hashing: k positions out of two 64-bit hashes.
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add_to_bitmap(self, bitmap: bytearray, value: str) -> None:
+        for position in self.positions(value):
+            # Redis numbers bits from the most significant one.
+            bitmap[position >> 3] |= 0x80 >> (position & 7)
+
+    async def add(self, cache: aioredis.Redis, values: ty.Iterable[str]):
+        if not self.enabled:
+            return
+        positions = [p for value in values for p in self.positions(value)]
+        if positions:
+            await cache.eval(
+                ADD_SCRIPT, 2, self.key, self.building_key, *positions
+            )
+
+    async def might_contain(
+        self,
+        cache: aioredis.Redis,
+        values: ty.Sequence[str],
+    ) -> list[bool]:
+        """Check many values in a single round trip."""
+        if not self.enabled:
+            return [True] * len(values)
+        pipeline = cache.pipeline(transaction=False)
+        for value in values:
+            pipeline.eval(CHECK_SCRIPT, 1, self.key, *self.positions(value))
+        results = [bool(result) for result in await pipeline.execute()]
+        for result in results:
+            (self._maybe if result else self._absent).inc()
+        return results
+
+    async def exists(self, cache: aioredis.Redis) -> bool:
+        return not self.enabled or bool(await cache.exists(self.key))
+
+
+async def rebuild_filters(
+    cache: aioredis.Redis,
+    filters: ty.Sequence[BloomFilter],
+    rows: ty.Callable[[], ty.AsyncIterator[ty.Sequence[ty.Sequence[str]]]],
+) -> bool:
+    """Rebuild filters in bulk and swap them in at once.
+
+    `rows` is called to iterate over chunks of rows, which have a value,
+    or `None`, for each filter in order. It must be called only after the
+    filters are being rebuilt: values added by concurrent writers are
+    then either read by it or added to the new filters directly.
+
+    A single worker rebuilds at a time, others return `False` at once.
+    """
+    filters = [bloom for bloom in filters if bloom.enabled]
+    if not filters:
+        return True
+    lock_key = f"lock_{filters[0].key}"
+    lock_token = secrets.token_hex(8)
+    if not await cache.set(
+        lock_key, lock_token, nx=True, ex=REBUILD_LOCK_TIMEOUT
+    ):
+        return False
+    try:
+        pipeline = cache.pipeline(transaction=False)
+        for bloom in filters:
+            pipeline.delete(bloom.building_key)
+            pipeline.setbit(bloom.building_key, bloom.size - 1, 0)
+            pipeline.expire(bloom.building_key, REBUILD_LOCK_TIMEOUT)
+        await pipeline.execute()
+
+        bitmaps = [bytearray(math.ceil(bloom.size / 8)) for bloom in filters]
+        async for chunk in rows():
+            for row in chunk:
+                for bloom, bitmap, value in zip(filters, bitmaps, row):
+                    if value is not None:
+                        bloom.add_to_bitmap(bitmap, value)
+
+        pipeline = cache.pipeline(transaction=True)
+        for bloom, bitmap in zip(filters, bitmaps):
+            scanned_key = f"{bloom.key}_scanned"
+            pipeline.set(scanned_key, bytes(bitmap))
+            pipeline.bitop(
+                "OR", bloom.building_key, bloom.building_key, scanned_key
+            )
+            pipeline.rename(bloom.building_key, bloom.key)
+            pipeline.persist(bloom.key)
+            pipeline.delete(scanned_key)
+        await pipeline.execute()
+    finally:
+        await cache.eval(UNLOCK_SCRIPT, 1, lock_key, lock_token)
+    return True
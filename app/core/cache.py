@@ -1,45 +1,927 @@
+import asyncio
 import functools
+import gzip
+import hashlib
 import json
 import logging
+import math
+import random
+import secrets
+import time
+import typing as ty
+from collections import OrderedDict
+from datetime import datetime
 
+import aioredis
+from aioredis.client import Pipeline
+from starlette import status
+from starlette.exceptions import HTTPException
 from starlette.requests import Request
+from starlette.responses import Response
 
+from app.core import metrics
+from app.core.responses import (
+    format_http_date,
+    is_not_modified,
+    make_etag,
+    to_timestamp,
+)
+
+COMPRESS_LEVEL = 6
+COMPRESS_MIN_SIZE = 512
+# Stores a computed value only if the key still holds the value it replaces
+# (or nothing), so a fill never overwrites a newer write or a tombstone.
+# Given a modification time, it instead stores the value unless the key holds
+# a newer one, so writes committed out of order never go backwards.
+FILL_SCRIPT = """
+local current = redis.call("get", KEYS[1]) or ""
+if ARGV[4] then
+    -- A flags byte, then the modification time if flagged (`CacheEntry`).
+    local flags = string.byte(current, 1) or 0
+    if #current >= 9 and flags <= 31 and math.floor(flags / 4) % 2 == 1 then
+        local stored = 0
+        for i = 2, 9 do
+            stored = stored * 256 + string.byte(current, i)
+        end
+        if stored > tonumber(ARGV[4]) then
+            return 0
+        end
+    end
+elseif current ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[3]) > 0 then
+    redis.call("set", KEYS[1], ARGV[2], "ex", ARGV[3])
+else
+    redis.call("set", KEYS[1], ARGV[2])
+end
+return 1
+"""
+# Changes a counter only if it exists, so a missing one is not taken for 0.
+INCREMENT_SCRIPT = """
+if redis.call("exists", KEYS[1]) == 1 then
+    return redis.call("incrby", KEYS[1], ARGV[1])
+end
+return nil
+"""
+# Hotness of keys is reset daily, so keys that cooled down drop out.
+HOT_KEYS_TTL = 24 * 60 * 60
+HOT_KEY_SCRIPT = """
+redis.call("zincrby", KEYS[1], 1, ARGV[1])
+if redis.call("ttl", KEYS[1]) == -1 then
+    redis.call("expire", KEYS[1], ARGV[2])
+end
+"""
+INVALIDATION_CHANNEL = "cache_invalidation"
+INVALIDATION_RETRY_DELAY = 1.0
+LOCK_POLL_INTERVAL = 0.025
+LOCK_TIMEOUT = 5.0
+RECOMPUTE_TIME_SMOOTHING = 0.2
+# Releases a lock only if it is still held by the same owner.
+UNLOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
 logger = logging.getLogger(__name__)
 
 
+class TimedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started_at = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            metrics.observe_redis_command(
+                "PIPELINE", time.perf_counter() - started_at
+            )
+
+
+class TimedRedis(aioredis.Redis):
+    """Redis client observing the latency of every command and pipeline."""
+
+    async def execute_command(self, *args, **options):
+        started_at = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            metrics.observe_redis_command(
+                args[0], time.perf_counter() - started_at
+            )
+
+    def pipeline(
+        self,
+        transaction: bool = True,
+        shard_hint: str | None = None,
+    ) -> TimedPipeline:
+        return TimedPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint,
+        )
+
+
+class BatchingRedis(TimedRedis):
+    """Redis client sending the commands issued within a tick as a pipeline.
+
+    Commands are queued instead of being sent right away, and the queue is
+    flushed by a callback scheduled for the next event loop iteration. So
+    lookups of concurrent requests and independent commands of one request
+    gathered together share a single round trip and a single connection.
+    Explicit pipelines and pub/sub bypass the queue.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queue: list[tuple[tuple, dict, asyncio.Future]] = []
+        self._flushes: set[asyncio.Task] = set()
+
+    async def execute_command(self, *args, **options):
+        loop = asyncio.get_running_loop()
+        if not self._queue:
+            loop.call_soon(self._flush)
+        future = loop.create_future()
+        self._queue.append((args, options, future))
+        started_at = time.perf_counter()
+        try:
+            return await future
+        finally:
+            metrics.observe_redis_command(
+                args[0], time.perf_counter() - started_at
+            )
+
+    def _flush(self) -> None:
+        commands, self._queue = self._queue, []
+        task = asyncio.create_task(self._send(commands))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _send(
+        self,
+        commands: list[tuple[tuple, dict, asyncio.Future]],
+    ) -> None:
+        pipeline = self.pipeline(transaction=False)
+        pipeline.command_stack.extend(
+            (args, options) for args, options, _ in commands
+        )
+        try:
+            results = await pipeline.execute(raise_on_error=False)
+        except Exception as e:
+            results = [e] * len(commands)
+        for (*_, future), result in zip(commands, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class LocalCache:
+    """Per-process LRU cache with a time-to-live for every entry.
+
+    It sits in front of Redis for the hottest keys. Entries evicted in
+    Redis are evicted here by `listen_invalidations`, the TTL only bounds
+    staleness if an invalidation message gets lost.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, ty.Any]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> ty.Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: ty.Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+async def listen_invalidations(
+    cache: aioredis.Redis,
+    local_cache: LocalCache,
+) -> None:
+    """Evict keys reset by any worker from the local cache.
+
+    Runs for the whole life of the application. While the subscription is
+    broken, other workers' resets are missed, so the local cache is dropped
+    every time it is (re)established.
+    """
+    while True:
+        pubsub = cache.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            local_cache.clear()
+            async for message in pubsub.listen():
+                local_cache.delete(message["data"].decode())
+        except (aioredis.ConnectionError, aioredis.TimeoutError) as e:
+            logger.warning(f"Lost cache invalidation channel: {e}")
+            local_cache.clear()
+            await asyncio.sleep(INVALIDATION_RETRY_DELAY)
+        finally:
+            await pubsub.reset()
+
+
+class CacheEntry:
+    """Value stored in the cache: a ready-to-send body and its metadata.
+
+    Packed, an entry is a byte of flags, the modification time if flagged,
+    and the body. Legacy values are bare JSON documents, their first byte
+    is never a valid flags byte.
+    """
+
+    GZIP = 0x01
+    TOMBSTONE = 0x02
+    LAST_MODIFIED = 0x04
+    MAX_FLAGS = 0x1F
+
+    __slots__ = (
+        "body",
+        "compressed",
+        "tombstone",
+        "last_modified",
+        "_digest",
+    )
+
+    def __init__(
+        self,
+        body: bytes,
+        compressed: bool = False,
+        tombstone: bool = False,
+        last_modified: int | None = None,
+    ):
+        self.body = body
+        self.compressed = compressed
+        # Marks a value deleted for a while, so that fills racing with the
+        # deletion cannot bring it back.
+        self.tombstone = tombstone
+        # Seconds since the epoch, sent as `Last-Modified`.
+        self.last_modified = last_modified
+        self._digest: str | None = None
+
+    @classmethod
+    def from_body(
+        cls,
+        body: bytes,
+        compress: bool = False,
+        last_modified: int | None = None,
+    ) -> "CacheEntry":
+        if compress and len(body) >= COMPRESS_MIN_SIZE:
+            return cls(
+                # No timestamp, so equal bodies keep equal ETags.
+                gzip.compress(body, COMPRESS_LEVEL, mtime=0),
+                compressed=True,
+                last_modified=last_modified,
+            )
+        return cls(body, last_modified=last_modified)
+
+    @classmethod
+    def unpack(cls, raw: bytes) -> "CacheEntry":
+        flags = raw[0]
+        if flags > cls.MAX_FLAGS:
+            return cls(raw)
+        last_modified = None
+        start = 1
+        if flags & cls.LAST_MODIFIED:
+            last_modified = int.from_bytes(raw[1:9], "big")
+            start = 9
+        return cls(
+            raw[start:],
+            compressed=bool(flags & cls.GZIP),
+            tombstone=bool(flags & cls.TOMBSTONE),
+            last_modified=last_modified,
+        )
+
+    def pack(self) -> bytes:
+        flags = self.GZIP if self.compressed else 0
+        if self.tombstone:
+            flags |= self.TOMBSTONE
+        if self.last_modified is None:
+            return bytes([flags]) + self.body
+        flags |= self.LAST_MODIFIED
+        return (
+            bytes([flags]) + self.last_modified.to_bytes(8, "big") + self.body
+        )
+
+    @property
+    def digest(self) -> str:
+        # Entries kept in the local cache are hashed once.
+        if self._digest is None:
+            self._digest = hashlib.blake2b(
+                self.body, digest_size=8
+            ).hexdigest()
+        return self._digest
+
+    def decompressed(self) -> bytes:
+        if self.compressed:
+            return gzip.decompress(self.body)
+        return self.body
+
+
 def make_cache_key(prefix: str, **kwargs):
     kwargs_serialized = "_".join([f"{k}_{v}" for k, v in kwargs.items()])
     return f"{prefix}_{kwargs_serialized}"
 
 
+def versioned_prefix(
+    prefix: str,
+    version: int,
+    generation: int | None = None,
+) -> str:
+    """Namespace keys by the schema version of values and a generation.
+
+    Changing the shape of cached values needs a new version, so values of
+    the old shape are never read. Bumping a generation abandons all keys
+    of the previous one at once.
+    """
+    if generation is None:
+        return f"{prefix}_v{version}"
+    return f"{prefix}_v{version}_g{generation}"
+
+
+def _make_generation_key(prefix: str) -> str:
+    return f"generation_{prefix}"
+
+
+async def get_generation(
+    cache: aioredis.Redis,
+    prefix: str,
+    local_cache: LocalCache | None = None,
+) -> int:
+    """Current generation of a key family, see `bump_generation`."""
+    key = _make_generation_key(prefix)
+    if local_cache is not None:
+        generation = local_cache.get(key)
+        if generation is not None:
+            return generation
+    generation = int(await cache.get(key) or 0)
+    if local_cache is not None:
+        local_cache.set(key, generation)
+    return generation
+
+
+async def bump_generation(
+    cache: aioredis.Redis,
+    prefix: str,
+    local_cache: LocalCache | None = None,
+) -> None:
+    """Invalidate a whole key family with a single `INCR`.
+
+    Abandoned keys are not deleted, they expire. Local copies of the
+    generation are evicted through the invalidation channel.
+    """
+    key = _make_generation_key(prefix)
+    pipeline = cache.pipeline(transaction=False)
+    pipeline.incr(key)
+    if local_cache is not None:
+        local_cache.delete(key)
+        pipeline.publish(INVALIDATION_CHANNEL, key)
+    await pipeline.execute()
+
+
+async def get_entries(
+    cache: aioredis.Redis,
+    keys: list[str],
+    local_cache: LocalCache | None = None,
+) -> list[CacheEntry | None]:
+    """Look up many keys at once, with a single `MGET` for local misses.
+
+    Tombstones are returned as misses.
+    """
+    entries = [
+        None if local_cache is None else local_cache.get(key) for key in keys
+    ]
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+    if not missing:
+        return entries
+    values = await cache.mget([keys[i] for i in missing])
+    for i, value in zip(missing, values):
+        if not value:
+            continue
+        entry = CacheEntry.unpack(value)
+        if entry.tombstone:
+            continue
+        entries[i] = entry
+        if local_cache is not None:
+            local_cache.set(keys[i], entry)
+    return entries
+
+
+async def set_entries(
+    cache: aioredis.Redis,
+    entries: dict[str, CacheEntry],
+    ttl: int | None = None,
+    nx: bool = False,
+) -> list[bool]:
+    """Store many entries in a single pipeline, telling which were stored.
+
+    Fills of values read from the database should pass `nx`, so they
+    never overwrite values written since or tombstones.
+    """
+    pipeline = cache.pipeline(transaction=False)
+    for key, entry in entries.items():
+        pipeline.set(key, entry.pack(), ex=ttl, nx=nx)
+    return [bool(stored) for stored in await pipeline.execute()]
+
+
+async def increment_counter(
+    cache: aioredis.Redis,
+    key: str,
+    amount: int = 1,
+) -> None:
+    """Change a counter, unless it has expired and awaits a recount."""
+    await cache.eval(INCREMENT_SCRIPT, 1, key, amount)
+
+
+def _make_hot_keys_key(prefix: str) -> str:
+    return f"hot_keys_{prefix}"
+
+
+async def get_hot_keys(
+    cache: aioredis.Redis,
+    prefix: str,
+    count: int,
+) -> list[str]:
+    """Most read keys of a prefix, for endpoints tracking them."""
+    keys = await cache.zrevrange(_make_hot_keys_key(prefix), 0, count - 1)
+    return [key.decode() for key in keys]
+
+
+def _get_local_cache(request: Request) -> LocalCache | None:
+    return getattr(request.app.state, "local_cache", None)
+
+
+async def _replace_entry(
+    request: Request,
+    cache_key: str,
+    entry: CacheEntry | None,
+    ttl: int | None = None,
+) -> None:
+    """Overwrite or delete a key, evicting it from all local caches.
+
+    An entry with a modification time does not overwrite a newer one.
+    """
+    pipeline = request.app.state.cache.pipeline(transaction=False)
+    if entry is None:
+        pipeline.delete(cache_key)
+    elif entry.last_modified is None:
+        pipeline.set(cache_key, entry.pack(), ex=ttl)
+    else:
+        pipeline.eval(
+            FILL_SCRIPT,
+            1,
+            cache_key,
+            b"",
+            entry.pack(),
+            ttl or 0,
+            entry.last_modified,
+        )
+    local_cache = _get_local_cache(request)
+    if local_cache is not None:
+        local_cache.delete(cache_key)
+        pipeline.publish(INVALIDATION_CHANNEL, cache_key)
+    await pipeline.execute()
+
+
+def _get_last_modified(
+    last_modified: ty.Callable[[ty.Any], datetime | None] | None,
+    result: ty.Any,
+) -> int | None:
+    modified_at = None if last_modified is None else last_modified(result)
+    return None if modified_at is None else to_timestamp(modified_at)
+
+
+def _make_endpoint_key(
+    prefix: str,
+    significant_args: list[str] | None,
+    kwargs: dict[str, ty.Any],
+) -> str:
+    if significant_args is None:
+        significant_args = sorted(kwargs.keys())
+    return make_cache_key(
+        prefix=prefix,
+        **{key: kwargs[key] for key in significant_args},
+    )
+
+
+def _accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "")
+
+
+def _mark_retrieved(future: asyncio.Future) -> None:
+    # Nobody may be waiting for the shared result. Don't let asyncio
+    # complain about an exception that was never retrieved.
+    if not future.cancelled():
+        future.exception()
+
+
+class _CachedEndpoint:
+    """Per-endpoint state of the `cached` decorator."""
+
+    def __init__(
+        self,
+        coro: ty.Callable,
+        prefix: str,
+        significant_args: list[str] | None,
+        local: bool,
+        ttl: int | ty.Callable[[ty.Any], int | None] | None,
+        early_refresh: float,
+        negative_ttl: int | None,
+        raw: bool,
+        compress: bool,
+        media_type: str,
+        hot_keys_sample_rate: float,
+        last_modified: ty.Callable[[ty.Any], datetime | None] | None,
+        cache_control: str | None,
+    ):
+        self.coro = coro
+        self.prefix = prefix
+        self.significant_args = significant_args
+        self.local = local
+        self.ttl = ttl
+        self.early_refresh = early_refresh if ttl else 0.0
+        self.negative_ttl = negative_ttl
+        self.raw = raw
+        self.compress = compress
+        self.media_type = media_type
+        self.hot_keys_sample_rate = hot_keys_sample_rate
+        self.last_modified = last_modified
+        self.cache_control = cache_control
+        self.hot_keys_key = _make_hot_keys_key(prefix)
+        self.metrics = metrics.CacheMetrics(prefix)
+        # Smoothed time of a recomputation, used for early refresh.
+        self.recompute_time = 0.0
+        self.in_flight: dict[str, asyncio.Future] = {}
+        self.hot_key_updates: set[asyncio.Task] = set()
+
+    async def __call__(self, *args, request: Request, **kwargs):
+        cache = request.app.state.cache
+        local_cache = _get_local_cache(request) if self.local else None
+        cache_key = _make_endpoint_key(
+            self.prefix, self.significant_args, kwargs
+        )
+        if (
+            self.hot_keys_sample_rate
+            and random.random() < self.hot_keys_sample_rate
+        ):
+            # Counted in the background, hits are not slowed down by it.
+            task = asyncio.create_task(self.record_hot_key(cache, cache_key))
+            self.hot_key_updates.add(task)
+            task.add_done_callback(self.hot_key_updates.discard)
+        if local_cache is not None:
+            entry = local_cache.get(cache_key)
+            if entry is not None:
+                logger.debug(f"Found locally cached key {cache_key}")
+                self.metrics.local_hits.inc()
+                return self.render(entry, request)
+
+        current, expires_in = await self.get(cache, cache_key)
+        entry = current
+        if entry is not None and entry.tombstone and not self.negative_ttl:
+            entry = None
+        if entry is None:
+            self.metrics.misses.inc()
+        else:
+            self.metrics.hits.inc()
+        if entry is None or self.should_refresh(expires_in):
+            entry = await self.coalesce(
+                cache_key,
+                entry,
+                functools.partial(
+                    self.recompute,
+                    cache,
+                    cache_key,
+                    entry,
+                    current,
+                    args,
+                    request,
+                    kwargs,
+                ),
+            )
+        if entry.tombstone:
+            raise HTTPException(
+                status.HTTP_404_NOT_FOUND,
+                json.loads(entry.body) if entry.body else None,
+            )
+        if local_cache is not None:
+            local_cache.set(cache_key, entry)
+        return self.render(entry, request)
+
+    async def record_hot_key(
+        self,
+        cache: aioredis.Redis,
+        cache_key: str,
+    ) -> None:
+        try:
+            await cache.eval(
+                HOT_KEY_SCRIPT, 1, self.hot_keys_key, cache_key, HOT_KEYS_TTL
+            )
+        except Exception as e:
+            logger.warning(f"Failed to record hot key {cache_key}: {e!r}")
+
+    def render(self, entry: CacheEntry, request: Request) -> ty.Any:
+        if not self.raw:
+            return json.loads(entry.decompressed())
+        etag = make_etag(entry.digest)
+        headers = {"ETag": etag}
+        if entry.last_modified is not None:
+            headers["Last-Modified"] = format_http_date(entry.last_modified)
+        if self.cache_control is not None:
+            headers["Cache-Control"] = self.cache_control
+        if entry.compressed:
+            headers["Vary"] = "Accept-Encoding"
+        if is_not_modified(request.headers, etag, entry.last_modified):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+            )
+        if not entry.compressed:
+            return Response(
+                entry.body, media_type=self.media_type, headers=headers
+            )
+        if not _accepts_gzip(request):
+            return Response(
+                entry.decompressed(),
+                media_type=self.media_type,
+                headers=headers,
+            )
+        headers["Content-Encoding"] = "gzip"
+        return Response(
+            entry.body, media_type=self.media_type, headers=headers
+        )
+
+    async def coalesce(
+        self,
+        cache_key: str,
+        stale_entry: CacheEntry | None,
+        compute: ty.Callable[[], ty.Awaitable[CacheEntry]],
+    ) -> CacheEntry:
+        future = self.in_flight.get(cache_key)
+        if future is not None:
+            if stale_entry is not None:
+                return stale_entry
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled, compute on our own.
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_mark_retrieved)
+        self.in_flight[cache_key] = future
+        try:
+            entry = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(entry)
+        finally:
+            if self.in_flight.get(cache_key) is future:
+                del self.in_flight[cache_key]
+        return entry
+
+    async def get(
+        self,
+        cache: aioredis.Redis,
+        cache_key: str,
+    ) -> tuple[CacheEntry | None, float | None]:
+        if self.early_refresh:
+            pipeline = cache.pipeline(transaction=False)
+            pipeline.get(cache_key)
+            pipeline.pttl(cache_key)
+            cached_result, pttl = await pipeline.execute()
+            expires_in = pttl / 1000 if pttl >= 0 else None
+        else:
+            cached_result = await cache.get(cache_key)
+            expires_in = None
+        if not cached_result:
+            return None, None
+        logger.debug(f"Found cached key {cache_key}")
+        return CacheEntry.unpack(cached_result), expires_in
+
+    def should_refresh(self, expires_in: float | None) -> bool:
+        """Decide on a probabilistic early recomputation.
+
+        It is the XFetch algorithm: the closer the expiration and the longer
+        the recomputation, the more likely a request recomputes the value,
+        so a hot key is refreshed by a single request before it expires.
+        """
+        if not self.early_refresh or expires_in is None:
+            return False
+        return (
+            -self.recompute_time
+            * self.early_refresh
+            * math.log(1.0 - random.random())
+            >= expires_in
+        )
+
+    async def recompute(
+        self,
+        cache: aioredis.Redis,
+        cache_key: str,
+        stale_entry: CacheEntry | None,
+        current: CacheEntry | None,
+        args: tuple,
+        request: Request,
+        kwargs: dict[str, ty.Any],
+    ) -> CacheEntry:
+        """Compute the value and store it unless the key changed since.
+
+        `current` is what the key held when it was read: nothing, a stale
+        entry or a tombstone. With `negative_ttl`, "not found" errors are
+        stored as tombstones.
+        """
+        if stale_entry is not None:
+            logger.debug(f"Refreshing key {cache_key} early")
+        lock_key = f"lock_{cache_key}"
+        lock_token = secrets.token_hex(8)
+        locked = await cache.set(
+            lock_key, lock_token, nx=True, px=int(LOCK_TIMEOUT * 1000)
+        )
+        if not locked:
+            # Another worker is recomputing the value.
+            if stale_entry is not None:
+                return stale_entry
+            entry = await self.wait_for(cache, cache_key)
+            if entry is not None:
+                return entry
+        started_at = time.perf_counter()
+        try:
+            entry, ttl = await self.compute(args, request, kwargs)
+        except BaseException:
+            if locked:
+                await cache.eval(UNLOCK_SCRIPT, 1, lock_key, lock_token)
+            raise
+        logger.debug(f"Caching key {cache_key}")
+        # Store the value and release the lock in one round trip.
+        pipeline = cache.pipeline(transaction=False)
+        pipeline.eval(
+            FILL_SCRIPT,
+            1,
+            cache_key,
+            b"" if current is None else current.pack(),
+            entry.pack(),
+            ttl or 0,
+        )
+        if locked:
+            pipeline.eval(UNLOCK_SCRIPT, 1, lock_key, lock_token)
+        await pipeline.execute()
+        self.metrics.sets.inc()
+        self.recompute_time += RECOMPUTE_TIME_SMOOTHING * (
+            time.perf_counter() - started_at - self.recompute_time
+        )
+        return entry
+
+    async def compute(
+        self,
+        args: tuple,
+        request: Request,
+        kwargs: dict[str, ty.Any],
+    ) -> tuple[CacheEntry, int | None]:
+        try:
+            result = await self.coro(*args, request=request, **kwargs)
+        except HTTPException as e:
+            if (
+                not self.negative_ttl
+                or e.status_code != status.HTTP_404_NOT_FOUND
+            ):
+                raise
+            return (
+                CacheEntry(json.dumps(e.detail).encode(), tombstone=True),
+                self.negative_ttl,
+            )
+        entry = CacheEntry.from_body(
+            result.json().encode(),
+            compress=self.compress,
+            last_modified=_get_last_modified(self.last_modified, result),
+        )
+        return entry, self.ttl(result) if callable(self.ttl) else self.ttl
+
+    async def wait_for(
+        self,
+        cache: aioredis.Redis,
+        cache_key: str,
+    ) -> CacheEntry | None:
+        """Wait for the worker holding the lock to store the value.
+
+        Returns nothing as soon as the lock is released without a value,
+        e.g. when the computation failed, so the caller computes it.
+        """
+        lock_key = f"lock_{cache_key}"
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            # The value is stored before the lock is released.
+            pipeline = cache.pipeline(transaction=False)
+            pipeline.exists(lock_key)
+            pipeline.get(cache_key)
+            locked, cached_result = await pipeline.execute()
+            if cached_result:
+                entry = CacheEntry.unpack(cached_result)
+                if self.negative_ttl or not entry.tombstone:
+                    return entry
+            if not locked:
+                return None
+        logger.warning(f"Gave up waiting for key {cache_key}")
+        return None
+
+
 def cached(
     prefix: str | None = None,
     significant_args: list[str] | None = None,
+    local: bool = False,
+    ttl: int | ty.Callable[[ty.Any], int | None] | None = None,
+    early_refresh: float = 0.0,
+    negative_ttl: int | None = None,
+    raw: bool = False,
+    compress: bool = False,
+    media_type: str = "application/json",
+    hot_keys_sample_rate: float = 0.0,
+    last_modified: ty.Callable[[ty.Any], datetime | None] | None = None,
+    cache_control: str | None = None,
 ):
+    """Cache results of an endpoint in Redis.
+
+    Concurrent misses of the same key are coalesced: a single coroutine per
+    worker recomputes the value, and a Redis lock keeps other workers
+    waiting for it instead of recomputing too.
+
+    Args:
+        prefix: Cache key prefix. Defaults to the endpoint name.
+        significant_args: Endpoint arguments the key is built from.
+            Defaults to all keyword arguments.
+        local: Also keep results in the per-process `LocalCache`, if the
+            application has one.
+        ttl: Expiration of cached results, in seconds, or a function
+            of the result returning it.
+        early_refresh: Eagerness of the probabilistic recomputation before
+            the expiration. Zero disables it, one is a sane default.
+            Requires `ttl`.
+        negative_ttl: Also cache "not found" errors of the endpoint, for
+            this many seconds. Tombstones left by `resets_cache` are then
+            errors too.
+        raw: Return the cached body as a ready `Response` instead of
+            decoding it, so a hit is sent without any parsing, validation
+            or encoding.
+        compress: Keep large bodies gzipped. Clients accepting gzip get
+            them as is.
+        media_type: Content type of raw responses.
+        hot_keys_sample_rate: Share of calls counted to find the most read
+            keys, see `get_hot_keys`. Zero disables counting.
+        last_modified: Function of the result returning when it last
+            changed, in UTC. Raw responses carry it as `Last-Modified`.
+        cache_control: `Cache-Control` of raw responses.
+
+    Raw responses carry an `ETag` of the cached body, and requests whose
+    validators match the cached entry get `304` without any query.
+    """
+
     def decorate(coro):
+        endpoint = _CachedEndpoint(
+            coro,
+            prefix=prefix if isinstance(prefix, str) else coro.__name__,
+            significant_args=significant_args,
+            local=local,
+            ttl=ttl,
+            early_refresh=early_refresh,
+            negative_ttl=negative_ttl,
+            raw=raw,
+            compress=compress,
+            media_type=media_type,
+            hot_keys_sample_rate=hot_keys_sample_rate,
+            last_modified=last_modified,
+            cache_control=cache_control,
+        )
+
         @functools.wraps(coro)
         async def wrapper(*args, request: Request, **kwargs):
-            nonlocal prefix
-            if prefix is None:
-                prefix = coro.__name__
-            nonlocal significant_args
-            if significant_args is None:
-                significant_args = sorted(kwargs.keys())
-            cache = request.app.state.cache
-            cache_key = make_cache_key(
-                prefix=prefix,
-                **{key: kwargs[key] for key in significant_args},
-            )
-            cached_result = await cache.get(cache_key)
-            if cached_result:
-                logger.debug(f"Found cached key {cache_key}")
-                return json.loads(cached_result)
-
-            result = await coro(*args, request=request, **kwargs)
-
-            logger.debug(f"Caching key {cache_key}")
-            await cache.set(cache_key, result.json())
-            return result
+            return await endpoint(*args, request=request, **kwargs)
 
         return wrapper
 
@@ -49,25 +931,94 @@ def cached(
         return decorate(prefix)
 
 
+def writes_cache(
+    prefix: str,
+    significant_args: list[str] | None = None,
+    ttl: int | None = None,
+    compress: bool = False,
+    last_modified: ty.Callable[[ty.Any], datetime | None] | None = None,
+):
+    """Store the result of an endpoint changing a cached value.
+
+    The result is written through under the key `cached` reads it by, in
+    the same format, so the next read is a hit instead of a query. It is
+    written once the request's transaction is committed.
+
+    Args:
+        prefix: Cache key prefix of the reading endpoint.
+        significant_args: Endpoint arguments the key is built from.
+        ttl: Expiration of the stored result, in seconds.
+        compress: Whether the reading endpoint compresses its results.
+        last_modified: Same as the reading endpoint's.
+    """
+
+    def decorate(coro):
+        sets = metrics.CacheMetrics(prefix).sets
+
+        @functools.wraps(coro)
+        async def wrapper(*args, request: Request, **kwargs):
+            result = await coro(*args, request=request, **kwargs)
+
+            cache_key = _make_endpoint_key(prefix, significant_args, kwargs)
+            entry = CacheEntry.from_body(
+                result.json().encode(),
+                compress=compress,
+                last_modified=_get_last_modified(last_modified, result),
+            )
+
+            async def write_through() -> None:
+                logger.debug(f"Writing key {cache_key} through")
+                await _replace_entry(request, cache_key, entry, ttl)
+                sets.inc()
+
+            request.state.db.on_commit(write_through)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
 def resets_cache(
     prefix: str,
     significant_args: list[str] | None = None,
+    tombstone_ttl: int | None = None,
+    tombstone_detail: ty.Any = None,
 ):
+    """Reset the cached value an endpoint changes once it is committed.
+
+    Args:
+        prefix: Cache key prefix of the reading endpoint.
+        significant_args: Endpoint arguments the key is built from.
+        tombstone_ttl: Replace the value with a tombstone for this many
+            seconds instead of deleting it. Fills racing with the reset
+            then cannot store the value read before it.
+        tombstone_detail: Detail of the "not found" error the reading
+            endpoint raises, sent for the tombstone instead of the default.
+    """
+
     def decorate(coro):
+        evictions = metrics.CacheMetrics(prefix).evictions
+
         @functools.wraps(coro)
         async def wrapper(*args, request: Request, **kwargs):
             result = await coro(*args, request=request, **kwargs)
 
-            nonlocal significant_args
-            if significant_args is None:
-                significant_args = sorted(kwargs.keys())
-            cache = request.app.state.cache
-            cache_key = make_cache_key(
-                prefix=prefix,
-                **{key: kwargs[key] for key in significant_args},
+            cache_key = _make_endpoint_key(prefix, significant_args, kwargs)
+            entry = (
+                CacheEntry(
+                    json.dumps(tombstone_detail).encode(), tombstone=True
+                )
+                if tombstone_ttl
+                else None
             )
-            logger.debug(f"Resetting key {cache_key}")
-            await cache.delete(cache_key)
+
+            async def reset() -> None:
+                logger.debug(f"Resetting key {cache_key}")
+                await _replace_entry(request, cache_key, entry, tombstone_ttl)
+                evictions.inc()
+
+            request.state.db.on_commit(reset)
             return result
 
         return wrapper
@@ -0,0 +1,97 @@
+import asyncio
+import base64
+import typing as ty
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from hashlib import sha256
+
+from cryptography.fernet import Fernet
+from starlette import status
+from starlette.exceptions import HTTPException
+
+RETRY_AFTER = 1
+
+
+def hash_password(password: str) -> str:
+    return sha256(password.encode()).hexdigest()
+
+
+def hash_passwords(passwords: list[str]) -> list[str]:
+    return [hash_password(password) for password in passwords]
+
+
+def anonymize(password_hash: str, *values: str) -> list[str]:
+    fernet = Fernet(key=base64.b64encode(bytes.fromhex(password_hash)))
+    return [fernet.encrypt(value.encode()).hex() for value in values]
+
+
+class CryptoBusy(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            "Server is busy",
+            headers={"Retry-After": str(RETRY_AFTER)},
+        )
+
+
+class CryptoService:
+    """Run CPU-heavy cryptography off the event loop.
+
+    At most `max_pending` jobs are queued or running at once. Callers wait
+    for a free slot up to `queue_timeout` seconds and get `CryptoBusy`
+    after that, so a burst of logins cannot pile up unbounded work.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        max_pending: int,
+        queue_timeout: float,
+    ):
+        self.executor = executor
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_pending)
+
+    @classmethod
+    def create(
+        cls,
+        kind: ty.Literal["thread", "process"],
+        workers: int | None,
+        max_pending: int,
+        queue_timeout: float,
+    ) -> "CryptoService":
+        executor_class = (
+            ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+        )
+        return cls(
+            executor_class(max_workers=workers),
+            max_pending=max_pending,
+            queue_timeout=queue_timeout,
+        )
+
+    async def run(self, func: ty.Callable, *args) -> ty.Any:
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError as e:
+            raise CryptoBusy() from e
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, func, *args
+            )
+        finally:
+            self._slots.release()
+
+    async def hash_password(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def hash_passwords(self, passwords: list[str]) -> list[str]:
+        return await self.run(hash_passwords, passwords)
+
+    async def anonymize(self, password_hash: str, *values: str) -> list[str]:
+        return await self.run(anonymize, password_hash, *values)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
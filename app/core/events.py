@@ -1,26 +1,131 @@
+import asyncio
+import contextlib
+import logging
 import typing as ty
 
 import aioredis
 from fastapi import FastAPI
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    create_async_engine,
+)
 
+from app.core import metrics
+from app.core.cache import (
+    BatchingRedis,
+    LocalCache,
+    TimedRedis,
+    listen_invalidations,
+)
+from app.core.crypto import CryptoService
+from app.core.health import warm_up
+from app.core.queries import queries
+from app.core.session import DatabaseRouter
+from app.core.tokens import TokenSigner
 from app.settings import settings
 
+logger = logging.getLogger(__name__)
+
+
+def create_engine(url: str) -> AsyncEngine:
+    return create_async_engine(
+        url.replace("postgresql://", "postgresql+asyncpg://"),
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
+
+
+def create_redis_client(url: str) -> aioredis.Redis:
+    redis_class = (
+        BatchingRedis if settings.redis_batch_commands else TimedRedis
+    )
+    return redis_class(
+        connection_pool=aioredis.BlockingConnectionPool.from_url(
+            url,
+            max_connections=settings.redis_max_connections,
+            timeout=settings.redis_pool_timeout,
+            socket_connect_timeout=settings.redis_connect_timeout,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_keepalive=settings.redis_socket_keepalive,
+            health_check_interval=settings.redis_health_check_interval,
+        )
+    )
+
 
 def create_start_app_handler(app: FastAPI) -> ty.Callable:
     async def start_app() -> None:
-        app.state.db_pool = create_async_engine(
-            settings.db_url.replace("postgresql://", "postgresql+asyncpg://"),
-            pool_size=5,
+        app.state.db_pool = create_engine(settings.db_url)
+        app.state.db_router = DatabaseRouter(
+            app.state.db_pool,
+            replicas=[create_engine(url) for url in settings.db_replica_urls],
+            strategy=settings.db_replica_strategy,
+        )
+        metrics.instrument_engine(app.state.db_pool, "primary")
+        for i, replica in enumerate(app.state.db_router.replicas):
+            metrics.instrument_engine(replica, f"replica_{i}")
+        metrics.instrument_routes(app.routes)
+        queries.compile(app.state.db_pool.dialect)
+        app.state.cache = create_redis_client(settings.redis_url)
+        app.state.crypto = CryptoService.create(
+            settings.crypto_executor,
+            workers=settings.crypto_workers,
+            max_pending=settings.crypto_max_pending,
+            queue_timeout=settings.crypto_queue_timeout,
         )
-        app.state.cache = aioredis.Redis.from_url(settings.redis_url)
+        app.state.local_cache = None
+        app.state.ready = False
+        app.state.background_tasks = []
+        if settings.local_cache_size > 0:
+            app.state.local_cache = LocalCache(
+                max_size=settings.local_cache_size,
+                ttl=settings.local_cache_ttl,
+            )
+            app.state.background_tasks.append(
+                asyncio.create_task(
+                    listen_invalidations(
+                        app.state.cache, app.state.local_cache
+                    )
+                )
+            )
+        if settings.token_mode == "signed":
+            app.state.tokens = TokenSigner(
+                secret=settings.token_secret,
+                key_version=settings.token_key_version,
+                ttl=settings.token_ttl,
+            )
+            app.state.background_tasks.append(
+                asyncio.create_task(
+                    app.state.tokens.sync_revocations(
+                        app.state.cache,
+                        interval=settings.token_revocation_sync_interval,
+                    )
+                )
+            )
+
+        app.state.background_tasks.append(asyncio.create_task(warm_up(app)))
 
     return start_app
 
 
 def create_stop_app_handler(app: FastAPI) -> ty.Callable:
     async def stop_app() -> None:
-        await app.state.db_pool.dispose()
+        app.state.ready = False
+        for task in app.state.background_tasks:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        app.state.crypto.shutdown()
+        logger.info(
+            f"Query compile cache hit rate: "
+            f"{queries.stats.compile_hit_rate:.2%}, "
+            f"prepared statement hit rate: "
+            f"{queries.stats.prepared_hit_rate:.2%}"
+        )
+        await app.state.db_router.dispose()
         await app.state.cache.close()
+        await app.state.cache.connection_pool.disconnect()
 
     return stop_app
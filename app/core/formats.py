@@ -0,0 +1,133 @@
+import codecs
+import csv
+import io
+import json
+import typing as ty
+from datetime import datetime
+
+CSV = "text/csv"
+NDJSON = "application/x-ndjson"
+MEDIA_TYPES = (NDJSON, CSV)
+FORMATS = {"csv": CSV, "ndjson": NDJSON}
+
+Record = dict[str, ty.Any]
+
+
+class UnsupportedFormat(ValueError):
+    pass
+
+
+async def iter_lines(
+    stream: ty.AsyncIterable[bytes],
+) -> ty.AsyncIterator[str]:
+    """Split a stream of UTF-8 chunks into lines."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    tail = ""
+    async for chunk in stream:
+        *lines, tail = (tail + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            yield line
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _parse_ndjson(lines: list[str]) -> list[Record | None]:
+    records: list[Record | None] = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        records.append(record if isinstance(record, dict) else None)
+    return records
+
+
+def _parse_csv(lines: list[str], header: list[str]) -> list[Record | None]:
+    records: list[Record | None] = []
+    for line in lines:
+        # A line per reader keeps a stray quote from swallowing next rows.
+        row: list[str] = next(csv.reader([line]), [])
+        records.append(
+            dict(zip(header, row)) if len(row) == len(header) else None
+        )
+    return records
+
+
+async def iter_record_batches(
+    stream: ty.AsyncIterable[bytes],
+    media_type: str,
+    batch_size: int,
+) -> ty.AsyncIterator[list[tuple[int, Record | None]]]:
+    """Parse a streamed NDJSON or CSV body in batches.
+
+    Yields lists of numbered records, numbering from one and skipping blank
+    lines and the CSV header. Records that cannot be parsed are `None`.
+    A CSV record must fit in a single line.
+    """
+    if media_type not in MEDIA_TYPES:
+        raise UnsupportedFormat(media_type)
+    header = None
+    numbers: list[int] = []
+    lines: list[str] = []
+    row_no = 0
+    async for line in iter_lines(stream):
+        line = line.rstrip("\r")
+        if not line.strip():
+            continue
+        if media_type == CSV and header is None:
+            [header] = csv.reader([line])
+            continue
+        row_no += 1
+        numbers.append(row_no)
+        lines.append(line)
+        if len(lines) >= batch_size:
+            yield _parse_batch(numbers, lines, media_type, header)
+            numbers, lines = [], []
+    if lines:
+        yield _parse_batch(numbers, lines, media_type, header)
+
+
+def _parse_batch(
+    numbers: list[int],
+    lines: list[str],
+    media_type: str,
+    header: list[str] | None,
+) -> list[tuple[int, Record | None]]:
+    if media_type == CSV:
+        assert header is not None
+        records = _parse_csv(lines, header)
+    else:
+        records = _parse_ndjson(lines)
+    return list(zip(numbers, records))
+
+
+def _encode_value(value: ty.Any) -> ty.Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_ndjson(records: ty.Iterable[ty.Mapping[str, ty.Any]]) -> bytes:
+    return "".join(
+        json.dumps(dict(record), default=_encode_value) + "\n"
+        for record in records
+    ).encode()
+
+
+def encode_csv(
+    records: ty.Iterable[ty.Mapping[str, ty.Any]],
+    columns: list[str],
+) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        [_encode_value(record[column]) for column in columns]
+        for record in records
+    )
+    return buffer.getvalue().encode()
+
+
+def encode_csv_header(columns: list[str]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(columns)
+    return buffer.getvalue().encode()
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+import typing as ty
+
+from fastapi import (
+    APIRouter,
+    FastAPI,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette import status
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.core.queries import queries
+from app.core.session import LazyConnection
+from app.settings import settings
+
+WARM_UP_RETRY_DELAY = 1.0
+logger = logging.getLogger(__name__)
+health_router = APIRouter(prefix="/health")
+warm_up_hooks: list[ty.Callable[[FastAPI], ty.Awaitable[None]]] = []
+
+
+def on_warm_up(hook: ty.Callable[[FastAPI], ty.Awaitable[None]]):
+    """Register a coroutine run once connections are warm."""
+    warm_up_hooks.append(hook)
+    return hook
+
+
+async def _warm_up_engine(engine: AsyncEngine, connections: int) -> None:
+    # Hold all connections at once, so the pool opens as many.
+    dbs = [
+        LazyConnection(engine, read_only=True)
+        for _ in range(min(connections, engine.pool.size()))
+    ]
+    try:
+        await asyncio.gather(*(queries.warm_up(db) for db in dbs))
+    finally:
+        # A connection cancelled amid a statement fails to close: that
+        # must neither skip the others nor turn a cancellation into a
+        # retry.
+        await asyncio.gather(
+            *(db.close() for db in dbs), return_exceptions=True
+        )
+
+
+async def _warm_up(app: FastAPI) -> None:
+    for engine in app.state.db_router.engines:
+        await _warm_up_engine(engine, settings.db_warm_up_connections)
+    await app.state.cache.ping()
+    for hook in warm_up_hooks:
+        await hook(app)
+
+
+async def warm_up(app: FastAPI) -> None:
+    """Prepare the application for traffic, then mark it ready.
+
+    Opens pool connections and prepares hot statements on them, checks
+    Redis and runs `on_warm_up` hooks. Retries until it succeeds, or
+    gives up after `warm_up_timeout` seconds: a cold application is only
+    slower, while one never ready takes no traffic at all.
+    """
+    deadline = time.monotonic() + settings.warm_up_timeout
+    while True:
+        try:
+            await _warm_up(app)
+        except Exception as e:
+            if time.monotonic() >= deadline:
+                logger.error(f"Gave up warming up: {e!r}")
+                break
+            logger.warning(f"Failed to warm up: {e!r}")
+            await asyncio.sleep(WARM_UP_RETRY_DELAY)
+        else:
+            logger.info("Warmed up")
+            break
+    app.state.ready = True
+
+
+@health_router.get("/live", response_class=Response)
+async def check_liveness():
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@health_router.get("/ready", response_class=Response)
+async def check_readiness(request: Request):
+    """Tell if the application is warm and not shutting down."""
+    state = request.app.state
+    if getattr(state, "ready", False) and not getattr(
+        state, "draining", False
+    ):
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -0,0 +1,241 @@
+import time
+import typing as ty
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.types import (
+    ASGIApp,
+    Message,
+    Receive,
+    Scope,
+    Send,
+)
+
+if ty.TYPE_CHECKING:
+    from app.core.queries import QueryStats
+
+OTHER = "other"
+REDIS_COMMANDS = (
+    "DEL",
+    "EVAL",
+    "GET",
+    "INCR",
+    "MGET",
+    "PIPELINE",
+    "PTTL",
+    "PUBLISH",
+    "SET",
+    "ZADD",
+)
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+UNMATCHED_ROUTE = "unmatched"
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight",
+    "Admitted requests being handled.",
+    ["route_class"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth",
+    "Requests waiting for admission.",
+    ["route_class"],
+)
+ADMISSION_SHED = Counter(
+    "admission_shed_total",
+    "Requests rejected before being handled.",
+    ["route_class", "reason"],
+)
+BLOOM_CHECKS = Counter(
+    "bloom_filter_checks_total",
+    "Bloom filter lookups, by whether the value is surely absent.",
+    ["filter", "result"],
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle an HTTP request.",
+    ["method", "route", "status"],
+)
+CACHE_HITS = Counter(
+    "cache_hits_total",
+    "Cached endpoint results found, by cache layer.",
+    ["prefix", "layer"],
+)
+CACHE_MISSES = Counter(
+    "cache_misses_total",
+    "Cached endpoint results not found.",
+    ["prefix"],
+)
+CACHE_SETS = Counter(
+    "cache_sets_total",
+    "Cached endpoint results stored.",
+    ["prefix"],
+)
+CACHE_EVICTIONS = Counter(
+    "cache_evictions_total",
+    "Cached endpoint results reset on changes.",
+    ["prefix"],
+)
+DB_CHECKOUT_DURATION = Histogram(
+    "db_pool_checkout_seconds",
+    "Time to get a connection from the pool.",
+    ["engine"],
+)
+DB_CONNECTIONS_IN_USE = Gauge(
+    "db_pool_connections_in_use",
+    "Connections checked out from the pool.",
+    ["engine"],
+)
+DB_POOL_SIZE = Gauge(
+    "db_pool_size",
+    "Connections kept in the pool.",
+    ["engine"],
+)
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds",
+    "Time to get a reply to a Redis command.",
+    ["command"],
+    buckets=(
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+    ),
+)
+
+# Label children are created in advance, so the hot path only finds and
+# updates them. The route ones are keyed by endpoint, method and status.
+# Requests without a matched route have no endpoint.
+_route_durations: dict[tuple[ty.Callable | None, str, int], Histogram] = {}
+_unmatched_durations = {
+    i: REQUEST_DURATION.labels(OTHER, UNMATCHED_ROUTE, status_class)
+    for i, status_class in enumerate(STATUS_CLASSES, 1)
+}
+_checkout_durations: dict[ty.Any, Histogram] = {}
+_redis_durations = {
+    command: REDIS_COMMAND_DURATION.labels(command)
+    for command in (*REDIS_COMMANDS, OTHER)
+}
+
+
+class CacheMetrics:
+    """Counters of a single cache prefix."""
+
+    __slots__ = ("local_hits", "hits", "misses", "sets", "evictions")
+
+    def __init__(self, prefix: str):
+        self.local_hits = CACHE_HITS.labels(prefix, "local")
+        self.hits = CACHE_HITS.labels(prefix, "redis")
+        self.misses = CACHE_MISSES.labels(prefix)
+        self.sets = CACHE_SETS.labels(prefix)
+        self.evictions = CACHE_EVICTIONS.labels(prefix)
+
+
+class QueryStatsCollector(Collector):
+    """Expose `QueryStats` counters, read at scrape time."""
+
+    def __init__(self, stats: "QueryStats"):
+        self.stats = stats
+
+    def collect(self) -> ty.Iterator[CounterMetricFamily]:
+        for kind in ("compile", "prepared"):
+            counter = CounterMetricFamily(
+                f"query_{kind}_cache",
+                f"Registered query {kind} cache lookups.",
+                labels=["result"],
+            )
+            counter.add_metric(["hit"], getattr(self.stats, f"{kind}_hits"))
+            counter.add_metric(["miss"], getattr(self.stats, f"{kind}_misses"))
+            yield counter
+
+
+def instrument_routes(routes: ty.Iterable[ty.Any]) -> None:
+    for route in routes:
+        if not isinstance(route, Route) or route.methods is None:
+            continue
+        for method in route.methods:
+            for i, status_class in enumerate(STATUS_CLASSES, 1):
+                _route_durations[
+                    route.endpoint, method, i
+                ] = REQUEST_DURATION.labels(
+                    method, route.path_format, status_class
+                )
+
+
+def instrument_engine(engine: AsyncEngine, name: str) -> None:
+    pool = engine.sync_engine.pool
+    _checkout_durations[pool] = DB_CHECKOUT_DURATION.labels(name)
+    DB_CONNECTIONS_IN_USE.labels(name).set_function(pool.checkedout)
+    DB_POOL_SIZE.labels(name).set_function(pool.size)
+
+
+def observe_checkout(engine: AsyncEngine, seconds: float) -> None:
+    child = _checkout_durations.get(engine.sync_engine.pool)
+    if child is not None:
+        child.observe(seconds)
+
+
+def observe_redis_command(command: str | bytes, seconds: float) -> None:
+    if isinstance(command, bytes):
+        command = command.decode()
+    child = _redis_durations.get(command.upper())
+    if child is None:
+        child = _redis_durations[OTHER]
+    child.observe(seconds)
+
+
+class MetricsMiddleware:
+    """Observe the latency of every HTTP request by route and status.
+
+    The route is found by the endpoint the router stored in the scope, so
+    paths with parameters fall under their template.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            status_class = min(max(status_code // 100, 1), 5)
+            child = _route_durations.get(
+                (scope.get("endpoint"), scope["method"], status_class)
+            )
+            if child is None:
+                child = _unmatched_durations[status_class]
+            child.observe(time.perf_counter() - started_at)
+
+
+def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,50 @@
+import base58
+from starlette.datastructures import URL
+
+CURSOR_SIZE = 4
+# Ids are `int4`, larger cursors would fail in the database.
+MAX_CURSOR = 2**31 - 1
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(id: int) -> str:
+    size = max((id.bit_length() + 7) // 8, 1)
+    return base58.b58encode(id.to_bytes(size, "big")).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        raw = base58.b58decode(cursor)
+    except ValueError as e:
+        raise InvalidCursor(cursor) from e
+    if not 0 < len(raw) <= CURSOR_SIZE:
+        raise InvalidCursor(cursor)
+    id = int.from_bytes(raw, "big")
+    if id > MAX_CURSOR:
+        raise InvalidCursor(cursor)
+    return id
+
+
+def make_link_header(
+    url: URL,
+    *,
+    first_id: int,
+    last_id: int,
+    has_next: bool,
+    has_previous: bool,
+) -> str:
+    """Build an RFC 8288 `Link` header pointing to neighbouring pages."""
+    base_url = url.remove_query_params(["offset", "after", "before"])
+    links = {}
+    if has_next:
+        links["next"] = base_url.include_query_params(
+            after=encode_cursor(last_id)
+        )
+    if has_previous:
+        links["prev"] = base_url.include_query_params(
+            before=encode_cursor(first_id)
+        )
+    return ", ".join(f'<{link}>; rel="{rel}"' for rel, link in links.items())
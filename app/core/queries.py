@@ -0,0 +1,129 @@
+import logging
+import typing as ty
+
+from prometheus_client import REGISTRY
+from sqlalchemy.engine import (
+    Compiled,
+    Dialect,
+)
+from sqlalchemy.sql import Executable
+
+from app.core.metrics import QueryStatsCollector
+from app.core.session import LazyConnection
+
+PREPARED_INFO_KEY = "prepared_queries"
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    __slots__ = (
+        "compile_hits",
+        "compile_misses",
+        "prepared_hits",
+        "prepared_misses",
+    )
+
+    def __init__(self):
+        self.compile_hits = 0
+        self.compile_misses = 0
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+
+    @staticmethod
+    def _rate(hits: int, misses: int) -> float:
+        total = hits + misses
+        return hits / total if total else 0.0
+
+    @property
+    def compile_hit_rate(self) -> float:
+        return self._rate(self.compile_hits, self.compile_misses)
+
+    @property
+    def prepared_hit_rate(self) -> float:
+        return self._rate(self.prepared_hits, self.prepared_misses)
+
+
+class QueryRegistry:
+    """Hot statements, compiled once and reused on every execution.
+
+    Ad hoc statements pay for building the expression, computing its cache
+    key and looking it up on every call. Registered statements are compiled
+    at startup and executed as is. asyncpg keeps a prepared statement per
+    SQL string on each pooled connection, so after the first execution on a
+    connection Postgres neither parses nor plans them again. The registry
+    remembers which statements each connection has prepared to count hits.
+    """
+
+    def __init__(self):
+        self._statements: dict[str, Executable] = {}
+        self._compiled: dict[str, Compiled] = {}
+        self._warm_up_params: dict[str, dict[str, ty.Any]] = {}
+        self.stats = QueryStats()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._statements
+
+    def __iter__(self) -> ty.Iterator[str]:
+        return iter(self._statements)
+
+    def register(
+        self,
+        name: str,
+        statement: Executable,
+        warm_up: dict[str, ty.Any] | None = None,
+    ) -> None:
+        """Add a statement to the registry.
+
+        Args:
+            name: Name to execute the statement by.
+            statement: The statement.
+            warm_up: Harmless parameters to prepare a read-only statement
+                with on fresh connections.
+        """
+        if name in self._statements:
+            raise ValueError(f"Query {name} is already registered")
+        self._statements[name] = statement
+        if warm_up is not None:
+            self._warm_up_params[name] = warm_up
+
+    def compile(self, dialect: Dialect) -> None:
+        for name in self._statements:
+            self._compile(name, dialect)
+
+    def _compile(self, name: str, dialect: Dialect) -> Compiled:
+        compiled = self._compiled[name] = self._statements[name].compile(
+            dialect=dialect
+        )
+        self.stats.compile_misses += 1
+        return compiled
+
+    async def warm_up(self, db: LazyConnection) -> None:
+        """Prepare statements having warm-up parameters on a connection."""
+        for name, params in self._warm_up_params.items():
+            await self.execute(db, name, **params)
+
+    async def execute(self, db: LazyConnection, name: str, /, **params):
+        """Execute a statement by name with bind parameters.
+
+        The statement name is positional-only, so a bind parameter may be
+        called `name` too.
+        """
+        compiled = self._compiled.get(name)
+        if compiled is None:
+            compiled = self._compile(name, db.engine.dialect)
+        else:
+            self.stats.compile_hits += 1
+        connection = await db.connect()
+        prepared: set[str] = connection.info.setdefault(
+            PREPARED_INFO_KEY, set()
+        )
+        if name in prepared:
+            self.stats.prepared_hits += 1
+        else:
+            self.stats.prepared_misses += 1
+            prepared.add(name)
+        return await connection.execute(compiled, params)
+
+
+queries = QueryRegistry()
+REGISTRY.register(QueryStatsCollector(queries.stats))
@@ -0,0 +1,71 @@
+import calendar
+import email.utils
+import typing as ty
+from datetime import datetime
+
+import orjson
+from starlette.datastructures import Headers
+
+
+def encode_rows(
+    rows: ty.Iterable[ty.Mapping[str, ty.Any]],
+    fields: ty.Sequence[str],
+) -> bytes:
+    """Encode database rows as a JSON array, without pydantic models.
+
+    Meant for trusted rows already matching the response model: only
+    `fields` of every row are kept and nothing is validated. Datetimes are
+    encoded by orjson in the same ISO 8601 format pydantic uses.
+    """
+    return orjson.dumps(
+        [{field: row[field] for field in fields} for row in rows]
+    )
+
+
+def make_cache_control(max_age: int, stale_while_revalidate: int = 0) -> str:
+    """`Cache-Control` of public responses, revalidated without a max age."""
+    if max_age <= 0:
+        return "no-cache"
+    value = f"public, max-age={max_age}"
+    if stale_while_revalidate > 0:
+        value += f", stale-while-revalidate={stale_while_revalidate}"
+    return value
+
+
+def make_etag(*parts: str) -> str:
+    # Weak, since gzipped and plain bodies share it.
+    return f'W/"{"-".join(parts)}"'
+
+
+def to_timestamp(dt: datetime) -> int:
+    """Seconds since the epoch of a UTC datetime, naive ones included."""
+    return calendar.timegm(dt.utctimetuple())
+
+
+def format_http_date(timestamp: int) -> str:
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def is_not_modified(
+    headers: Headers,
+    etag: str,
+    last_modified: int | None = None,
+) -> bool:
+    """Evaluate `If-None-Match` or `If-Modified-Since` of a request.
+
+    `If-Modified-Since` is ignored when `If-None-Match` is sent.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        }
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    return last_modified <= to_timestamp(since)
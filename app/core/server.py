@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import typing as ty
+from multiprocessing.connection import wait
+
+import uvicorn
+from fastapi import FastAPI
+from uvicorn.importer import import_from_string
+
+WORKER_RESTART_DELAY = 1.0
+WorkerContext = (
+    multiprocessing.context.ForkContext | multiprocessing.context.SpawnContext
+)
+logger = logging.getLogger(__name__)
+
+
+def get_cpu_count() -> int:
+    # CPUs the process may run on, which containers often limit.
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server draining traffic before it shuts down.
+
+    On the first signal, the application reports itself not ready, so
+    load balancers stop sending requests, but keeps serving them for
+    `drain_delay` seconds. Then open connections get `graceful_timeout`
+    seconds to finish, and shutdown handlers close the DB pools and Redis
+    even if some did not. A second signal skips the drain delay.
+    """
+
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        app: FastAPI,
+        drain_delay: float,
+        graceful_timeout: float,
+    ):
+        super().__init__(config)
+        self.app = app
+        self.drain_delay = drain_delay
+        self.graceful_timeout = graceful_timeout
+        self._drain_timer: asyncio.TimerHandle | None = None
+        self._timed_out = False
+
+    def handle_exit(self, sig: int, frame) -> None:
+        if self._drain_timer is not None:
+            self._drain_timer.cancel()
+            self._drain_timer = None
+        elif self.drain_delay > 0 and not self.should_exit:
+            logger.info(f"Draining for {self.drain_delay} seconds")
+            self.app.state.draining = True
+            self._drain_timer = asyncio.get_event_loop().call_later(
+                self.drain_delay, super().handle_exit, sig, frame
+            )
+            return
+        super().handle_exit(sig, frame)
+
+    def _give_up(self) -> None:
+        logger.warning(
+            f"Connections still open after {self.graceful_timeout} seconds"
+        )
+        self._timed_out = True
+        self.force_exit = True
+
+    async def shutdown(self, sockets: list[socket.socket] | None = None):
+        timer = asyncio.get_event_loop().call_later(
+            self.graceful_timeout, self._give_up
+        )
+        try:
+            await super().shutdown(sockets)
+        finally:
+            timer.cancel()
+        # uvicorn skips shutdown handlers once it gives up waiting.
+        if self._timed_out:
+            await self.lifespan.shutdown()
+
+
+def _run_worker(
+    app_path: str,
+    config: dict[str, ty.Any],
+    drain_delay: float,
+    graceful_timeout: float,
+    sockets: list[socket.socket] | None = None,
+) -> None:
+    if sockets is not None:
+        # Let signals reach workers only through the supervisor, so a
+        # Ctrl+C in a terminal is not taken for two.
+        os.setpgrp()
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    app = import_from_string(app_path)
+    server = DrainingServer(
+        uvicorn.Config(app, **config),
+        app,
+        drain_delay=drain_delay,
+        graceful_timeout=graceful_timeout,
+    )
+    server.run(sockets=sockets)
+
+
+class Supervisor:
+    """Run workers sharing a socket, passing signals on to them.
+
+    Workers that die are replaced until a signal asks to stop.
+    """
+
+    def __init__(
+        self,
+        context: WorkerContext,
+        workers: int,
+        worker_args: tuple,
+    ):
+        self.context = context
+        self.workers = workers
+        self.worker_args = worker_args
+        # Processes by their sentinel, which `wait` returns once they end.
+        self.processes: dict[int, multiprocessing.process.BaseProcess] = {}
+        self.stopping = False
+
+    def start_worker(self) -> None:
+        process = self.context.Process(
+            target=_run_worker, args=self.worker_args
+        )
+        process.start()
+        self.processes[process.sentinel] = process
+
+    def stop(self, sig: int, frame) -> None:
+        self.stopping = True
+        for process in self.processes.values():
+            if process.is_alive() and process.pid is not None:
+                os.kill(process.pid, sig)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        logger.info(f"Starting {self.workers} workers")
+        for _ in range(self.workers):
+            self.start_worker()
+        while self.processes:
+            for sentinel in wait(list(self.processes)):
+                process = self.processes.pop(ty.cast(int, sentinel))
+                process.join()
+                if self.stopping:
+                    continue
+                logger.warning(
+                    f"Worker {process.pid} exited with code "
+                    f"{process.exitcode}"
+                )
+                time.sleep(WORKER_RESTART_DELAY)
+                if not self.stopping:
+                    self.start_worker()
+
+
+def serve(
+    app_path: str,
+    workers: int = 1,
+    preload: bool = False,
+    drain_delay: float = 0.0,
+    graceful_timeout: float = 30.0,
+    **config,
+) -> None:
+    """Serve an application by worker processes sharing a socket.
+
+    Workers are either spawned and import the application on their own,
+    or, with `preload`, forked from a supervisor that imported it, so
+    they share the memory of imported code.
+
+    Args:
+        app_path: Application as `module:attribute`.
+        workers: Number of worker processes.
+        preload: Import the application before forking workers.
+        drain_delay: See `DrainingServer`.
+        graceful_timeout: See `DrainingServer`.
+        **config: `uvicorn.Config` arguments.
+    """
+    if workers <= 1:
+        _run_worker(app_path, config, drain_delay, graceful_timeout)
+        return
+
+    context: WorkerContext
+    if preload:
+        import_from_string(app_path)
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context("spawn")
+    sock = uvicorn.Config(app_path, **config).bind_socket()
+    try:
+        Supervisor(
+            context,
+            workers,
+            (app_path, config, drain_delay, graceful_timeout, [sock]),
+        ).run()
+    finally:
+        sock.close()
@@ -0,0 +1,215 @@
+import itertools
+import logging
+import time
+import typing as ty
+
+from sqlalchemy.ext.asyncio import (
+    AsyncConnection,
+    AsyncEngine,
+)
+from starlette.requests import cookie_parser
+from starlette.types import (
+    ASGIApp,
+    Message,
+    Receive,
+    Scope,
+    Send,
+)
+
+from app.core import metrics
+
+READ_ONLY_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+READ_PRIMARY_COOKIE = "read_primary"
+logger = logging.getLogger(__name__)
+
+
+class DatabaseRouter:
+    """Pick an engine for a connection: the primary or a read replica."""
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: ty.Sequence[AsyncEngine] = (),
+        strategy: ty.Literal["round_robin", "least_busy"] = "round_robin",
+    ):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self._next_replica = itertools.cycle(self.replicas)
+
+    @property
+    def engines(self) -> list[AsyncEngine]:
+        return [self.primary, *self.replicas]
+
+    def for_read(self) -> AsyncEngine:
+        if not self.replicas:
+            return self.primary
+        if self.strategy == "least_busy":
+            return min(
+                self.replicas, key=lambda engine: engine.pool.checkedout()
+            )
+        return next(self._next_replica)
+
+    async def dispose(self) -> None:
+        for engine in self.engines:
+            await engine.dispose()
+
+
+class LazyConnection:
+    """Database connection checked out from the pool on first use.
+
+    Requests that never touch the database (cache hits, preflights,
+    errors raised before a query) never take a connection from the pool.
+    Read-only connections run in a `READ ONLY` transaction and are never
+    committed.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        read_only: bool = False,
+        primary: AsyncEngine | None = None,
+    ):
+        self.engine = engine
+        self.read_only = read_only
+        self.primary = engine if primary is None else primary
+        self._connection: AsyncConnection | None = None
+        self._commit_hooks: list[ty.Callable[[], ty.Awaitable[None]]] = []
+
+    def on_commit(self, hook: ty.Callable[[], ty.Awaitable[None]]) -> None:
+        """Run a coroutine once changes are committed and visible.
+
+        Hooks of a rolled back transaction are dropped. Failing hooks are
+        logged, the changes are committed already.
+        """
+        self._commit_hooks.append(hook)
+
+    def use_primary(self) -> None:
+        """Make reads that must see the latest data avoid replicas."""
+        if self.engine is self.primary:
+            return
+        if self._connection is not None:
+            raise RuntimeError("Already connected to a replica")
+        self.engine = self.primary
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None
+
+    async def connect(self) -> AsyncConnection:
+        if self._connection is None:
+            started_at = time.perf_counter()
+            connection = await self.engine.connect()
+            metrics.observe_checkout(
+                self.engine, time.perf_counter() - started_at
+            )
+            if self.read_only:
+                await connection.execution_options(postgresql_readonly=True)
+            self._connection = connection
+        return self._connection
+
+    async def execute(self, statement, parameters=None, **kwargs):
+        if getattr(statement, "_for_update_arg", None) is not None:
+            self.use_primary()
+        connection = await self.connect()
+        return await connection.execute(statement, parameters, **kwargs)
+
+    async def scalar(self, statement, parameters=None, **kwargs):
+        connection = await self.connect()
+        return await connection.scalar(statement, parameters, **kwargs)
+
+    async def stream(self, statement, parameters=None, **kwargs):
+        connection = await self.connect()
+        return await connection.stream(statement, parameters, **kwargs)
+
+    async def get_raw_connection(self):
+        connection = await self.connect()
+        return await connection.get_raw_connection()
+
+    async def commit(self) -> None:
+        connection = self._connection
+        if (
+            connection is not None
+            and not self.read_only
+            and connection.in_transaction()
+        ):
+            await connection.commit()
+        hooks, self._commit_hooks = self._commit_hooks, []
+        for hook in hooks:
+            try:
+                await hook()
+            except Exception as e:
+                logger.warning(f"Failed to run commit hook: {e!r}")
+
+    async def rollback(self) -> None:
+        self._commit_hooks.clear()
+        connection = self._connection
+        if connection is not None and connection.in_transaction():
+            await connection.rollback()
+
+    async def close(self) -> None:
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            await connection.close()
+
+
+def _reads_primary(scope: Scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            return READ_PRIMARY_COOKIE in cookie_parser(value.decode())
+    return False
+
+
+class DBSessionMiddleware:
+    """Provide every HTTP request with a `LazyConnection` as `state.db`.
+
+    Written as a pure ASGI middleware, so it neither spawns a task nor
+    copies the response stream. The transaction is committed right before
+    a successful response is started, so a failed commit still turns into
+    an error response; error responses roll it back.
+
+    Reads are routed to replicas. A successful write sets a short-lived
+    cookie sending the client's reads to the primary, so clients see their
+    own writes despite replication lag.
+    """
+
+    def __init__(self, app: ASGIApp, read_your_writes_window: int = 0):
+        self.app = app
+        self.read_primary_cookie = (
+            f"{READ_PRIMARY_COOKIE}=1; Max-Age={read_your_writes_window}; "
+            f"Path=/; HttpOnly; SameSite=Lax"
+        ).encode()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        router: DatabaseRouter = scope["app"].state.db_router
+        read_only = scope["method"] in READ_ONLY_METHODS
+        if read_only and not _reads_primary(scope):
+            engine = router.for_read()
+        else:
+            engine = router.primary
+        db = LazyConnection(
+            engine, read_only=read_only, primary=router.primary
+        )
+        scope.setdefault("state", {})["db"] = db
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                if message["status"] >= 400:
+                    await db.rollback()
+                else:
+                    await db.commit()
+                    if router.replicas and db.connected and not read_only:
+                        message["headers"] = [
+                            *message.get("headers", []),
+                            (b"set-cookie", self.read_primary_cookie),
+                        ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            await db.close()
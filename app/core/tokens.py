@@ -0,0 +1,127 @@
+import asyncio
+import base64
+import hmac
+import logging
+import secrets
+import struct
+import time
+from hashlib import sha256
+
+import aioredis
+
+REVOKED_TOKENS_KEY = "revoked_tokens"
+# Users whose tokens are all revoked, scored by the expiration of the last
+# token issued before.
+REVOKED_USERS_KEY = "revoked_users"
+SIGNATURE_SIZE = 16
+# User id, expiration timestamp, key version and a random token id.
+PAYLOAD_FORMAT = struct.Struct(">QQH8s")
+logger = logging.getLogger(__name__)
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class TokenSigner:
+    """Issue and verify self-contained access tokens.
+
+    A token carries the user id, its expiration and the signing key version
+    under an HMAC, so it is verified in-process. Tokens revoked before they
+    expire, one by one or all of a user's, are kept in Redis sorted sets,
+    mirrored locally by `sync_revocations`.
+    """
+
+    def __init__(self, secret: str, key_version: int, ttl: int):
+        self.key_version = key_version
+        self.ttl = ttl
+        self._key = hmac.new(
+            secret.encode(), f"v{key_version}".encode(), sha256
+        ).digest()
+        self._revoked: set[bytes] = set()
+        self._revoked_users: dict[int, float] = {}
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._key, payload, sha256).digest()[:SIGNATURE_SIZE]
+
+    def issue(self, user_id: int) -> str:
+        payload = PAYLOAD_FORMAT.pack(
+            user_id,
+            int(time.time()) + self.ttl,
+            self.key_version,
+            secrets.token_bytes(8),
+        )
+        return _b64encode(payload + self._sign(payload))
+
+    def _unpack(self, token: str) -> tuple[int, int, int, bytes]:
+        try:
+            raw = _b64decode(token)
+        except ValueError as e:
+            raise InvalidToken("Malformed token") from e
+        if len(raw) != PAYLOAD_FORMAT.size + SIGNATURE_SIZE:
+            raise InvalidToken("Malformed token")
+        payload, signature = raw[: PAYLOAD_FORMAT.size], raw[-SIGNATURE_SIZE:]
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            raise InvalidToken("Bad signature")
+        user_id, expires_at, key_version, token_id = PAYLOAD_FORMAT.unpack(
+            payload
+        )
+        return user_id, expires_at, key_version, token_id
+
+    def verify(self, token: str) -> int:
+        """Return the user id of a valid token."""
+        user_id, expires_at, key_version, token_id = self._unpack(token)
+        if key_version != self.key_version:
+            raise InvalidToken("Outdated key")
+        if expires_at <= time.time():
+            raise InvalidToken("Expired token")
+        if token_id in self._revoked:
+            raise InvalidToken("Revoked token")
+        if expires_at <= self._revoked_users.get(user_id, 0):
+            raise InvalidToken("Revoked token")
+        return user_id
+
+    async def revoke(self, token: str, *, cache: aioredis.Redis) -> None:
+        _, expires_at, _, token_id = self._unpack(token)
+        self._revoked.add(token_id)
+        await cache.zadd(REVOKED_TOKENS_KEY, {token_id: expires_at})
+
+    async def revoke_user(
+        self, user_id: int, *, cache: aioredis.Redis
+    ) -> None:
+        """Revoke all tokens issued to a user so far."""
+        revoked_until = int(time.time()) + self.ttl
+        self._revoked_users[user_id] = revoked_until
+        await cache.zadd(REVOKED_USERS_KEY, {str(user_id): revoked_until})
+
+    async def sync_revocations(
+        self,
+        cache: aioredis.Redis,
+        interval: float,
+    ) -> None:
+        """Mirror the revoked tokens of all workers, forever."""
+        while True:
+            try:
+                pipeline = cache.pipeline(transaction=False)
+                now = time.time()
+                pipeline.zremrangebyscore(REVOKED_TOKENS_KEY, "-inf", now)
+                pipeline.zremrangebyscore(REVOKED_USERS_KEY, "-inf", now)
+                pipeline.zrange(REVOKED_TOKENS_KEY, 0, -1)
+                pipeline.zrange(REVOKED_USERS_KEY, 0, -1, withscores=True)
+                _, _, revoked, revoked_users = await pipeline.execute()
+                self._revoked = set(revoked)
+                self._revoked_users = {
+                    int(user_id): revoked_until
+                    for user_id, revoked_until in revoked_users
+                }
+            except (aioredis.ConnectionError, aioredis.TimeoutError) as e:
+                logger.warning(f"Failed to sync revoked tokens: {e}")
+            await asyncio.sleep(interval)
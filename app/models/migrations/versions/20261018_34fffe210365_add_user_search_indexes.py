@@ -0,0 +1,59 @@
+"""Add user search indexes.
+
+Revision ID: 34fffe210365
+Revises: 37e7e25f9ca5
+Create Date: 2026-10-18 18:40:12.518230
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "34fffe210365"
+down_revision = "37e7e25f9ca5"
+branch_labels = None
+depends_on = None
+
+PREFIX_INDEXES = {
+    "ix_user_active_name_prefix": "name",
+    "ix_user_active_email_prefix": "email",
+}
+TRIGRAM_INDEXES = {
+    "ix_user_active_name_trgm": "name",
+    "ix_user_active_email_trgm": "email",
+}
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # Building the indexes concurrently keeps the table writable.
+    with op.get_context().autocommit_block():
+        for name, column in PREFIX_INDEXES.items():
+            op.create_index(
+                name,
+                "user",
+                [sa.text(f"lower({column}) text_pattern_ops")],
+                postgresql_where=sa.text("deleted_at IS NULL"),
+                postgresql_concurrently=True,
+            )
+        for name, column in TRIGRAM_INDEXES.items():
+            op.create_index(
+                name,
+                "user",
+                [column],
+                postgresql_using="gin",
+                postgresql_ops={column: "gin_trgm_ops"},
+                postgresql_where=sa.text("deleted_at IS NULL"),
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    # The extension stays, other schemas may use it.
+    with op.get_context().autocommit_block():
+        for name in [*PREFIX_INDEXES, *TRIGRAM_INDEXES]:
+            op.drop_index(
+                name,
+                table_name="user",
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,36 @@
+"""Add active user id index.
+
+Revision ID: 37e7e25f9ca5
+Revises: 79a91a05b3aa
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "37e7e25f9ca5"
+down_revision = "79a91a05b3aa"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Building the index concurrently keeps the table writable.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_user_active_id",
+            "user",
+            ["id"],
+            postgresql_where=sa.text("deleted_at IS NULL"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_user_active_id",
+            table_name="user",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,40 @@
+"""Widen user name and email.
+
+Revision ID: 5b0e6c1f2a47
+Revises: 34fffe210365
+Create Date: 2026-10-18 19:20:05.731914
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5b0e6c1f2a47"
+down_revision = "34fffe210365"
+branch_labels = None
+depends_on = None
+
+COLUMNS = ("name", "email")
+
+
+def upgrade():
+    # Widening a varchar neither rewrites the table nor its indexes.
+    for column in COLUMNS:
+        op.alter_column(
+            "user",
+            column,
+            type_=sa.String(length=1024),
+            existing_type=sa.String(length=64),
+            existing_nullable=False,
+        )
+
+
+def downgrade():
+    for column in COLUMNS:
+        op.alter_column(
+            "user",
+            column,
+            type_=sa.String(length=64),
+            existing_type=sa.String(length=1024),
+            existing_nullable=False,
+        )
@@ -9,13 +9,21 @@ from app.core.database import (
 
 __all__ = ("User",)
 
+# Deleted users keep their name and email encrypted, which takes more than
+# any active value.
+ANONYMIZED_LENGTH = 1024
+
 
 class User(Base):
     __tablename__ = "user"
 
     id: int = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
-    name: str = sa.Column(sa.String(length=64), nullable=False, unique=True)
-    email: str = sa.Column(sa.String(length=64), nullable=False, unique=True)
+    name: str = sa.Column(
+        sa.String(length=ANONYMIZED_LENGTH), nullable=False, unique=True
+    )
+    email: str = sa.Column(
+        sa.String(length=ANONYMIZED_LENGTH), nullable=False, unique=True
+    )
     password_hash: str = sa.Column(sa.String(length=64), nullable=False)
     created_at: datetime = sa.Column(
         sa.DateTime,
@@ -29,3 +37,47 @@ class User(Base):
         onupdate=utc_now,
     )
     deleted_at: datetime = sa.Column(sa.DateTime, nullable=True)
+
+    __table_args__ = (
+        sa.Index(
+            "ix_user_active_id",
+            id,
+            postgresql_where=deleted_at == None,
+        ),
+        sa.Index(
+            "ix_user_active_name_prefix",
+            sa.func.lower(name).label("name_lower"),
+            postgresql_ops={"name_lower": "text_pattern_ops"},
+            postgresql_where=deleted_at == None,
+        ),
+        sa.Index(
+            "ix_user_active_email_prefix",
+            sa.func.lower(email).label("email_lower"),
+            postgresql_ops={"email_lower": "text_pattern_ops"},
+            postgresql_where=deleted_at == None,
+        ),
+        sa.Index(
+            "ix_user_active_name_trgm",
+            name,
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+            postgresql_where=deleted_at == None,
+        ),
+        sa.Index(
+            "ix_user_active_email_trgm",
+            email,
+            postgresql_using="gin",
+            postgresql_ops={"email": "gin_trgm_ops"},
+            postgresql_where=deleted_at == None,
+        ),
+    )
+
+
+# Trigram indexes need the extension.
+sa.event.listen(
+    User.__table__,
+    "before_create",
+    sa.DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(
+        dialect="postgresql"
+    ),
+)
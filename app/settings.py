@@ -1,9 +1,11 @@
 import logging
 import os
+import typing as ty
 
 from pydantic import (
     BaseSettings,
     Field,
+    validator,
 )
 
 logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO")))
@@ -12,10 +14,74 @@ logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO")))
 class Settings(BaseSettings):
     # TODO: graylog logging
 
+    # Concurrent requests per route class, zero disables a limit.
+    admission_auth_limit: int = 16
+    admission_max_queue: int = 100
+    admission_queue_timeout: float = 0.5
+    admission_read_limit: int = 64
+    admission_retry_after: float = 1.0
+    admission_write_limit: int = 16
+    # Logins per second and client, zero disables the rate limit.
+    auth_rate_limit: float = 0.0
+    auth_rate_limit_burst: int = 10
+    # Expected values per Bloom filter, zero disables the filters.
+    bloom_capacity: int = 1_000_000
+    bloom_error_rate: float = 0.01
+    # Password hashing and anonymization run in this executor.
+    crypto_executor: ty.Literal["thread", "process"] = "thread"
+    crypto_max_pending: int = 64
+    crypto_queue_timeout: float = 1.0
+    crypto_workers: int | None = None
+    db_max_overflow: int = 10
+    db_pool_pre_ping: bool = False
+    db_pool_recycle: int = -1
+    db_pool_size: int = 5
+    db_pool_timeout: float = 30.0
+    # Reads go to replicas, if any, except right after a client's write.
+    db_read_your_writes_window: int = 5
+    db_replica_strategy: ty.Literal[
+        "round_robin", "least_busy"
+    ] = "round_robin"
+    db_replica_urls: list[str] = []
     db_url: str = Field(..., env="DATABASE_URL")
+    # Connections per engine opened before the application is ready.
+    db_warm_up_connections: int = 5
     debug: bool = True
+    # Per-process cache in front of Redis. Zero size disables it.
+    local_cache_size: int = 10_000
+    local_cache_ttl: float = 5.0
     project_name: str = "Simple API"
+    # Send Redis commands issued within an event loop tick as a pipeline.
+    redis_batch_commands: bool = True
+    redis_connect_timeout: float | None = 5.0
+    redis_health_check_interval: int = 30
+    redis_max_connections: int = 50
+    # Seconds to wait for a free connection when all are in use.
+    redis_pool_timeout: float = 5.0
+    redis_socket_keepalive: bool = True
+    redis_socket_timeout: float | None = 5.0
     redis_url: str = Field(..., env="REDIS_URL")
+    # Signed tokens are verified in-process, Redis ones need a lookup.
+    token_mode: ty.Literal["redis", "signed"] = "redis"
+    token_key_version: int = 1
+    token_revocation_sync_interval: float = 1.0
+    token_secret: str = ""
+    token_ttl: int = 24 * 60 * 60
+    # Cache-Control of user reads. Without a max age, clients revalidate.
+    user_list_max_age: int = 0
+    user_list_stale_while_revalidate: int = 0
+    user_max_age: int = 0
+    user_stale_while_revalidate: int = 0
+    # Most read users loaded into the caches before the application is ready.
+    warm_up_hot_users: int = 1000
+    # Seconds of failed warm-up attempts before serving traffic cold.
+    warm_up_timeout: float = 60.0
+
+    @validator("token_secret")
+    def check_token_secret(cls, value, values):
+        if values.get("token_mode") == "signed" and not value:
+            raise ValueError("Signed tokens require a secret")
+        return value
 
 
 settings = Settings()
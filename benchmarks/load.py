@@ -0,0 +1,82 @@
+import asyncio
+import dataclasses
+import math
+import time
+import typing as ty
+
+import httpx
+
+Call = ty.Callable[[httpx.AsyncClient], ty.Awaitable[httpx.Response]]
+
+
+@dataclasses.dataclass
+class LoadResult:
+    name: str
+    transport: str
+    requests: int
+    errors: int
+    concurrency: int
+    rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+    @property
+    def key(self) -> str:
+        return f"load:{self.transport}:{self.name}"
+
+    def as_dict(self) -> dict[str, ty.Any]:
+        return {"kind": "load", "key": self.key, **dataclasses.asdict(self)}
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    calls: ty.Iterable[Call],
+    *,
+    name: str,
+    transport: str,
+    concurrency: int,
+) -> LoadResult:
+    """Send requests made by `calls` from `concurrency` workers.
+
+    Every response with a status other than 2xx or 3xx counts as an error,
+    its latency is still recorded.
+    """
+    pending = iter(calls)
+    latencies: list[float] = []
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal errors
+        for call in pending:
+            started_at = time.perf_counter()
+            response = await call(client)
+            latencies.append(time.perf_counter() - started_at)
+            if response.status_code >= 400:
+                errors += 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+    latencies.sort()
+    return LoadResult(
+        name=name,
+        transport=transport,
+        requests=len(latencies),
+        errors=errors,
+        concurrency=concurrency,
+        rps=len(latencies) / elapsed if elapsed else 0.0,
+        p50_ms=percentile(latencies, 0.50) * 1000,
+        p95_ms=percentile(latencies, 0.95) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+        max_ms=(latencies[-1] if latencies else 0.0) * 1000,
+    )
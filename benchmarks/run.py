@@ -0,0 +1,186 @@
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import subprocess
+import sys
+import typing as ty
+
+import click
+
+from app.settings import settings
+
+from .micro import run_micro
+from .scenarios import run_scenarios
+from .stand_ins import (
+    create_database,
+    drop_database,
+    fake_redis,
+)
+from .targets import TARGETS
+
+# Metrics where a bigger value is a regression, the rest are throughputs.
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "ns_per_op")
+COMPARED_METRICS = {
+    "load": ("rps", "p95_ms", "p99_ms"),
+    "micro": ("ns_per_op",),
+}
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _run_load(
+    transports: list[str],
+    users: int,
+    requests: int,
+    concurrency: int,
+) -> list[dict[str, ty.Any]]:
+    # Imported late, so the application reads the patched settings.
+    from main import get_application
+
+    database_url = settings.db_url + "_bench"
+    await create_database(database_url, users)
+    settings.db_url = database_url
+    settings.db_replica_urls = []
+    results = []
+    try:
+        for transport in transports:
+            with fake_redis():
+                target = TARGETS[transport](get_application(), concurrency)
+                async with target as client:
+                    results.extend(
+                        await run_scenarios(
+                            target,
+                            client,
+                            users=users,
+                            requests=requests,
+                            concurrency=concurrency,
+                        )
+                    )
+    finally:
+        await drop_database(database_url)
+    return [result.as_dict() for result in results]
+
+
+def find_errors(report: dict[str, ty.Any]) -> list[str]:
+    """List scenarios having failed requests, their timings are moot."""
+    return [
+        f"{result['key']}: {result['errors']} of {result['requests']} "
+        f"requests failed"
+        for result in report["results"]
+        if result.get("errors")
+    ]
+
+
+def compare(
+    baseline: dict[str, ty.Any],
+    report: dict[str, ty.Any],
+    tolerance: float,
+) -> list[str]:
+    """List metrics that got worse than the baseline beyond tolerance."""
+    previous = {result["key"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = previous.get(result["key"])
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS[result["kind"]]:
+            if not old[metric]:
+                continue
+            change = result[metric] / old[metric] - 1
+            if metric not in LOWER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append(
+                    f"{result['key']} {metric}: {old[metric]:.2f} -> "
+                    f"{result[metric]:.2f} ({change:+.1%} worse)"
+                )
+    return regressions
+
+
+@click.command()
+@click.option(
+    "--transport",
+    "transports",
+    type=click.Choice(list(TARGETS)),
+    multiple=True,
+    help="Transports to load the application through. Defaults to all.",
+)
+@click.option("--users", default=10_000, help="Users to seed the DB with.")
+@click.option("--requests", default=2000, help="Requests per scenario.")
+@click.option("--concurrency", default=32, help="Requests in flight.")
+@click.option("--loops", default=10_000, help="Micro-benchmark loops.")
+@click.option(
+    "--micro-only",
+    is_flag=True,
+    help="Skip the load scenarios, which need a local Postgres.",
+)
+@click.option("--output", type=click.File("w"), default="-")
+@click.option(
+    "--baseline",
+    type=click.File(),
+    help="Previous report to compare with. Regressions fail the run.",
+)
+@click.option("--tolerance", default=0.1, help="Allowed relative change.")
+def main(
+    transports: tuple[str, ...],
+    users: int,
+    requests: int,
+    concurrency: int,
+    loops: int,
+    micro_only: bool,
+    output: ty.TextIO,
+    baseline: ty.TextIO | None,
+    tolerance: float,
+):
+    """Benchmark the API and write a JSON report.
+
+    Load scenarios run against a database created next to `DATABASE_URL`
+    and dropped afterwards, with an in-memory Redis. Scenarios having any
+    failed request fail the run.
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    results = [result.as_dict() for result in asyncio.run(run_micro(loops))]
+    if not micro_only:
+        results += asyncio.run(
+            _run_load(
+                list(transports or TARGETS), users, requests, concurrency
+            )
+        )
+    report = {
+        "meta": {
+            "created_at": datetime.datetime.now(
+                datetime.timezone.utc
+            ).isoformat(),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "users": users,
+            "requests": requests,
+            "concurrency": concurrency,
+        },
+        "results": results,
+    }
+    json.dump(report, output, indent=2)
+    output.write("\n")
+    failures = [f"Errors: {error}" for error in find_errors(report)]
+    if baseline is not None:
+        failures += [
+            f"Regression: {regression}"
+            for regression in compare(json.load(baseline), report, tolerance)
+        ]
+    for failure in failures:
+        click.echo(failure, err=True)
+    if failures:
+        sys.exit(1)
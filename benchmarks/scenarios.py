@@ -0,0 +1,154 @@
+import itertools
+import secrets
+import typing as ty
+
+import httpx
+from fastapi import FastAPI
+
+from app.api.users import DEFAULT_LIMIT
+
+from .load import (
+    Call,
+    LoadResult,
+    run_load,
+)
+from .stand_ins import (
+    PASSWORD,
+    user_name,
+)
+from .targets import Target
+
+# Users updating their own records, each needs a token.
+UPDATING_USERS = 100
+
+
+def _get(url: str, **kwargs) -> Call:
+    async def call(client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get(url, **kwargs)
+
+    return call
+
+
+def _post(url: str, **kwargs) -> Call:
+    async def call(client: httpx.AsyncClient) -> httpx.Response:
+        return await client.post(url, **kwargs)
+
+    return call
+
+
+def _patch(url: str, **kwargs) -> Call:
+    async def call(client: httpx.AsyncClient) -> httpx.Response:
+        return await client.patch(url, **kwargs)
+
+    return call
+
+
+def _authenticate(number: int) -> Call:
+    return _post(
+        "/api/auth",
+        data={"username": user_name(number), "password": PASSWORD},
+    )
+
+
+async def _reset_cache(app: FastAPI) -> None:
+    await app.state.cache.flushdb()
+    if app.state.local_cache is not None:
+        app.state.local_cache.clear()
+
+
+async def _issue_tokens(
+    client: httpx.AsyncClient,
+    user_ids: ty.Iterable[int],
+) -> dict[int, str]:
+    tokens = {}
+    for user_id in user_ids:
+        response = await _authenticate(user_id)(client)
+        response.raise_for_status()
+        tokens[user_id] = response.json()["access_token"]
+    return tokens
+
+
+def list_offsets(users: int) -> list[int]:
+    return sorted({0, users // 2, max(users - DEFAULT_LIMIT, 0)})
+
+
+async def run_scenarios(
+    target: Target,
+    client: httpx.AsyncClient,
+    *,
+    users: int,
+    requests: int,
+    concurrency: int,
+) -> list[LoadResult]:
+    """Load every benchmarked endpoint of a seeded application in turn.
+
+    Reads go first: the cold pass requests every user once on an empty
+    cache, the warm one repeats the same users.
+    """
+    user_ids = range(1, min(requests, users) + 1)
+
+    def cycle(calls: ty.Iterable[Call]) -> list[Call]:
+        return list(itertools.islice(itertools.cycle(calls), requests))
+
+    async def load(name: str, calls: list[Call]) -> LoadResult:
+        return await run_load(
+            client,
+            calls,
+            name=name,
+            transport=target.transport,
+            concurrency=concurrency,
+        )
+
+    await target.call_in_app(lambda: _reset_cache(target.app))
+    read_calls = [_get(f"/api/users/{user_id}") for user_id in user_ids]
+    results = [
+        await load("read_user_cold", read_calls),
+        await load("read_user_warm", cycle(read_calls)),
+    ]
+    for offset in list_offsets(users):
+        results.append(
+            await load(
+                f"list_users_offset_{offset}",
+                cycle([_get("/api/users/", params={"offset": offset})]),
+            )
+        )
+    results.append(
+        await load(
+            "authenticate",
+            cycle([_authenticate(user_id) for user_id in user_ids]),
+        )
+    )
+    run_id = secrets.token_hex(4)
+    results.append(
+        await load(
+            "create_user",
+            [
+                _post(
+                    "/api/users/",
+                    json={
+                        "name": f"bench_{run_id}_{number}",
+                        "email": f"bench_{run_id}_{number}@example.com",
+                        "password": PASSWORD,
+                    },
+                )
+                for number in range(requests)
+            ],
+        )
+    )
+    tokens = await _issue_tokens(client, user_ids[:UPDATING_USERS])
+    results.append(
+        await load(
+            "update_user",
+            [
+                _patch(
+                    f"/api/users/{user_id}",
+                    json={"email": f"{user_name(user_id)}_{number}@x.org"},
+                    headers={"Authorization": f"Bearer {tokens[user_id]}"},
+                )
+                for number, user_id in zip(
+                    range(requests), itertools.cycle(tokens)
+                )
+            ],
+        )
+    )
+    return results
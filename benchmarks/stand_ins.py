@@ -0,0 +1,85 @@
+import contextlib
+import typing as ty
+from unittest import mock
+
+import aioredis
+import fakeredis
+import sqlalchemy as sa
+from fakeredis.aioredis import FakeConnection
+
+from app import models
+from app.core import events
+from app.core.cache import (
+    BatchingRedis,
+    TimedRedis,
+)
+from app.core.crypto import hash_password
+from app.core.database import metadata
+from app.settings import settings
+from tests import setup
+
+PASSWORD = "password"
+SEED_BATCH_SIZE = 5000
+
+
+def user_name(number: int) -> str:
+    return f"user_{number}"
+
+
+def create_fake_redis_client(server: fakeredis.FakeServer) -> ty.Callable:
+    """Make a factory of in-memory Redis clients sharing `server`."""
+
+    def create_redis_client(url: str) -> aioredis.Redis:
+        redis_class = (
+            BatchingRedis if settings.redis_batch_commands else TimedRedis
+        )
+        return redis_class(
+            connection_pool=aioredis.ConnectionPool(
+                connection_class=FakeConnection,
+                server=server,
+                max_connections=settings.redis_max_connections,
+            )
+        )
+
+    return create_redis_client
+
+
+@contextlib.contextmanager
+def fake_redis() -> ty.Iterator[fakeredis.FakeServer]:
+    """Make the application use an in-memory Redis."""
+    server = fakeredis.FakeServer()
+    with mock.patch.object(
+        events, "create_redis_client", create_fake_redis_client(server)
+    ):
+        yield server
+
+
+async def create_database(url: str, users: int) -> None:
+    """Create a fresh database with `users` active users."""
+    await setup.create_db({"dsn": url}, delete_existing=True)
+    engine = sa.create_engine(url)
+    try:
+        metadata.create_all(bind=engine)
+        password_hash = hash_password(PASSWORD)
+        with engine.begin() as connection:
+            for start in range(1, users + 1, SEED_BATCH_SIZE):
+                connection.execute(
+                    sa.insert(models.User),
+                    [
+                        {
+                            "name": user_name(number),
+                            "email": f"{user_name(number)}@example.com",
+                            "password_hash": password_hash,
+                        }
+                        for number in range(
+                            start, min(start + SEED_BATCH_SIZE, users + 1)
+                        )
+                    ],
+                )
+            connection.execute(sa.text('ANALYZE "user"'))
+    finally:
+        engine.dispose()
+
+
+async def drop_database(url: str) -> None:
+    await setup.drop_db({"dsn": url})
@@ -0,0 +1,120 @@
+import abc
+import asyncio
+import threading
+import typing as ty
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+STARTUP_POLL_INTERVAL = 0.01
+
+
+class Target(abc.ABC):
+    """An application under load and a client sending requests to it."""
+
+    transport: str
+
+    def __init__(self, app: FastAPI, concurrency: int):
+        self.app = app
+        self.concurrency = concurrency
+
+    @abc.abstractmethod
+    async def __aenter__(self) -> httpx.AsyncClient:
+        """Start the application, returning a client once it is ready."""
+
+    @abc.abstractmethod
+    async def __aexit__(self, *exc_info) -> None:
+        """Stop the application."""
+
+    async def wait_until_ready(self, client: httpx.AsyncClient) -> None:
+        """Wait for the warm-up, so that it is not measured."""
+        while True:
+            response = await client.get("/health/ready")
+            if response.is_success:
+                return
+            await asyncio.sleep(STARTUP_POLL_INTERVAL)
+
+    async def call_in_app(
+        self,
+        func: ty.Callable[[], ty.Awaitable[ty.Any]],
+    ) -> ty.Any:
+        """Run a coroutine in the event loop of the application."""
+        return await func()
+
+
+class ASGITarget(Target):
+    """Call the application in-process, without any networking."""
+
+    transport = "asgi"
+
+    async def __aenter__(self) -> httpx.AsyncClient:
+        await self.app.router.startup()
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app),
+            base_url="http://benchmark",
+        )
+        await self.wait_until_ready(self.client)
+        return self.client
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.client.aclose()
+        await self.app.router.shutdown()
+
+
+class UvicornTarget(Target):
+    """Serve the application by uvicorn in a thread with its own loop."""
+
+    transport = "uvicorn"
+
+    async def __aenter__(self) -> httpx.AsyncClient:
+        self.server = uvicorn.Server(
+            uvicorn.Config(
+                self.app,
+                host="127.0.0.1",
+                port=0,
+                log_level="warning",
+                access_log=False,
+            )
+        )
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_until_complete,
+            args=(self.server.serve(),),
+            daemon=True,
+        )
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Server failed to start")
+            await asyncio.sleep(STARTUP_POLL_INTERVAL)
+        [server] = self.server.servers
+        host, port = server.sockets[0].getsockname()[:2]
+        self.client = httpx.AsyncClient(
+            base_url=f"http://{host}:{port}",
+            limits=httpx.Limits(max_connections=self.concurrency),
+        )
+        await self.wait_until_ready(self.client)
+        return self.client
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.client.aclose()
+        self.server.should_exit = True
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.thread.join
+        )
+        self.loop.close()
+
+    async def call_in_app(
+        self,
+        func: ty.Callable[[], ty.Awaitable[ty.Any]],
+    ) -> ty.Any:
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(func(), self.loop)
+        )
+
+
+TARGETS: dict[str, type[Target]] = {
+    ASGITarget.transport: ASGITarget,
+    UvicornTarget.transport: UvicornTarget,
+}
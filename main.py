@@ -1,30 +1,33 @@
+import click
 import uvicorn
 from fastapi import FastAPI
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
-from starlette.requests import Request
 
 from app.api import api_router
+from app.core.admission import AdmissionMiddleware
 from app.core.events import (
     create_start_app_handler,
     create_stop_app_handler,
 )
+from app.core.health import health_router
+from app.core.metrics import (
+    MetricsMiddleware,
+    metrics_endpoint,
+)
+from app.core.server import (
+    get_cpu_count,
+    serve,
+)
+from app.core.session import DBSessionMiddleware
 from app.settings import settings
 
 
-async def db_session_middleware(request: Request, call_next):
-    db_pool = request.app.state.db_pool
-    async with db_pool.connect() as db:
-        request.state.db = db
-        response = await call_next(request)
-        await db.commit()
-    return response
-
-
 def get_application() -> FastAPI:
     application = FastAPI(
         title=settings.project_name,
         debug=settings.debug,
+        default_response_class=ORJSONResponse,
     )
     application.add_middleware(
         CORSMiddleware,
@@ -32,10 +35,28 @@ def get_application() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["Link", "X-Page-Count", "X-Total-Count"],
+    )
+    application.add_middleware(
+        DBSessionMiddleware,
+        read_your_writes_window=settings.db_read_your_writes_window,
     )
     application.add_middleware(
-        BaseHTTPMiddleware,
-        dispatch=db_session_middleware,
+        AdmissionMiddleware,
+        limits={
+            "auth": settings.admission_auth_limit,
+            "read": settings.admission_read_limit,
+            "write": settings.admission_write_limit,
+        },
+        max_queue=settings.admission_max_queue,
+        queue_timeout=settings.admission_queue_timeout,
+        retry_after=settings.admission_retry_after,
+        auth_rate=settings.auth_rate_limit,
+        auth_burst=settings.auth_rate_limit_burst,
+    )
+    application.add_middleware(MetricsMiddleware)
+    application.add_route(
+        "/metrics", metrics_endpoint, include_in_schema=False
     )
     application.add_event_handler(
         "startup", create_start_app_handler(application)
@@ -44,12 +65,113 @@ def get_application() -> FastAPI:
         "shutdown", create_stop_app_handler(application)
     )
     application.include_router(api_router)
+    application.include_router(health_router)
     return application
 
 
 app = get_application()
 
-if __name__ == "__main__":
-    uvicorn.run(
-        "main:app", host="0.0.0.0", port=80, log_level="debug", reload=True
+
+@click.command(context_settings={"auto_envvar_prefix": "SERVER"})
+@click.option("--host", default="0.0.0.0", show_default=True)
+@click.option("--port", default=80, show_default=True)
+@click.option(
+    "--workers",
+    default=get_cpu_count(),
+    show_default="CPU count",
+    help="Worker processes.",
+)
+@click.option(
+    "--preload/--no-preload",
+    default=False,
+    show_default=True,
+    help="Import the application once and fork workers sharing it.",
+)
+@click.option(
+    "--loop",
+    type=click.Choice(["uvloop", "asyncio"]),
+    default="uvloop",
+    show_default=True,
+)
+@click.option(
+    "--http",
+    type=click.Choice(["httptools", "h11"]),
+    default="httptools",
+    show_default=True,
+)
+@click.option(
+    "--keep-alive",
+    default=65,
+    show_default=True,
+    help="Seconds to keep idle connections, longer than proxies do.",
+)
+@click.option(
+    "--backlog",
+    default=2048,
+    show_default=True,
+    help="Connections waiting to be accepted.",
+)
+@click.option(
+    "--limit-concurrency",
+    type=int,
+    default=None,
+    help="Connections and tasks per worker answered beyond with 503.",
+)
+@click.option(
+    "--drain-delay",
+    default=5.0,
+    show_default=True,
+    help="Seconds to keep serving while reported not ready on SIGTERM.",
+)
+@click.option(
+    "--graceful-timeout",
+    default=30.0,
+    show_default=True,
+    help="Seconds to wait for open connections on shutdown.",
+)
+@click.option("--log-level", default="info", show_default=True)
+@click.option(
+    "--reload",
+    is_flag=True,
+    help="Serve by a single worker restarted on code changes.",
+)
+def run(
+    host: str,
+    port: int,
+    workers: int,
+    preload: bool,
+    loop: str,
+    http: str,
+    keep_alive: int,
+    backlog: int,
+    limit_concurrency: int | None,
+    drain_delay: float,
+    graceful_timeout: float,
+    log_level: str,
+    reload: bool,
+):
+    """Serve the application."""
+    if reload:
+        uvicorn.run(
+            "main:app", host=host, port=port, log_level=log_level, reload=True
+        )
+        return
+    serve(
+        "main:app",
+        workers=workers,
+        preload=preload,
+        drain_delay=drain_delay,
+        graceful_timeout=graceful_timeout,
+        host=host,
+        port=port,
+        loop=loop,
+        http=http,
+        timeout_keep_alive=keep_alive,
+        backlog=backlog,
+        limit_concurrency=limit_concurrency,
+        log_level=log_level,
     )
+
+
+if __name__ == "__main__":
+    run()
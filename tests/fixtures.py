@@ -1,16 +1,29 @@
 import asyncio
 import logging
+import typing as ty
+from types import SimpleNamespace
+from unittest import mock
 
+import aioredis
 import databases
+import fakeredis
+import httpx
 import pytest
+from fastapi import FastAPI
 from sqlalchemy import create_engine
+from starlette.datastructures import State
+from starlette.requests import Request
 
+from app.core import events
 from app.core.database import metadata
 from app.settings import settings
+from benchmarks.stand_ins import create_fake_redis_client
 
 from . import setup
 
 DB_URL = settings.db_url + "_test"
+READY_POLL_INTERVAL = 0.01
+READY_TIMEOUT = 10.0
 python_range = range
 logger = logging.getLogger(__name__)
 
@@ -48,3 +61,78 @@ async def connect_db(test_engine, test_database):
     finally:
         logger.info("Dropping all data in DB")
         metadata.drop_all(bind=test_engine)
+
+
+@pytest.fixture
+def redis_server() -> fakeredis.FakeServer:
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+async def cache(redis_server) -> ty.AsyncIterator[aioredis.Redis]:
+    """In-memory Redis client, like the application's one."""
+    client = create_fake_redis_client(redis_server)("redis://test")
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+@pytest.fixture
+def make_request(cache) -> ty.Callable[..., Request]:
+    """Build requests to call endpoints with, without the application."""
+
+    def make_request(
+        headers: dict[str, str] | None = None,
+        **state,
+    ) -> Request:
+        app = SimpleNamespace(
+            state=State({"cache": cache, "local_cache": None, **state})
+        )
+        return Request(
+            {
+                "type": "http",
+                "method": "GET",
+                "path": "/",
+                "query_string": b"",
+                "headers": [
+                    (name.lower().encode(), value.encode())
+                    for name, value in (headers or {}).items()
+                ],
+                "app": app,
+                "state": {},
+            }
+        )
+
+    return make_request
+
+
+async def wait_until_ready(app: FastAPI) -> None:
+    while not app.state.ready:
+        await asyncio.sleep(READY_POLL_INTERVAL)
+
+
+@pytest.fixture
+async def app(redis_server) -> ty.AsyncIterator[FastAPI]:
+    """The application, on the test database and an in-memory Redis."""
+    # Imported here, so that only tests using it build the application.
+    import main
+
+    with mock.patch.object(settings, "db_url", DB_URL), mock.patch.object(
+        events, "create_redis_client", create_fake_redis_client(redis_server)
+    ):
+        await main.app.router.startup()
+        try:
+            # Tests send requests once warm, as load balancers do.
+            await asyncio.wait_for(wait_until_ready(main.app), READY_TIMEOUT)
+            yield main.app
+        finally:
+            await main.app.router.shutdown()
+
+
+@pytest.fixture
+async def client(app) -> ty.AsyncIterator[httpx.AsyncClient]:
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
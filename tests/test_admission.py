@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from starlette import status
+
+from app.core.admission import AdmissionMiddleware
+
+
+@pytest.fixture
+def app(cache) -> FastAPI:
+    """Application holding reads until `state.release` is set."""
+    app = FastAPI()
+    app.state.cache = cache
+    app.state.started = asyncio.Event()
+    app.state.release = asyncio.Event()
+    app.add_middleware(
+        AdmissionMiddleware,
+        limits={"read": 1, "write": 1},
+        max_queue=1,
+        queue_timeout=0.2,
+        retry_after=2.0,
+        auth_rate=0.01,
+        auth_burst=1,
+    )
+
+    @app.get("/")
+    async def read():
+        app.state.started.set()
+        await app.state.release.wait()
+
+    @app.post("/")
+    async def write():
+        pass
+
+    @app.post("/api/auth")
+    async def authenticate():
+        pass
+
+    return app
+
+
+async def test_sheds_reads_over_the_limit(app, client):
+    first = asyncio.create_task(client.get("/"))
+    await app.state.started.wait()
+    # One request waits in the queue and times out, the next finds it full.
+    queued = asyncio.create_task(client.get("/"))
+    await asyncio.sleep(0.01)
+    response = await client.get("/")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "2"
+    response = await queued
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    # Other route classes have limits of their own.
+    response = await client.post("/")
+    assert response.status_code == status.HTTP_200_OK
+    app.state.release.set()
+    response = await first
+    assert response.status_code == status.HTTP_200_OK
+
+
+async def test_rate_limits_authentication(client):
+    response = await client.post("/api/auth")
+    assert response.status_code == status.HTTP_200_OK
+    response = await client.post("/api/auth")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response.headers["Retry-After"]) > 0
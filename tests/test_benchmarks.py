@@ -0,0 +1,61 @@
+import asyncio
+
+from fastapi import FastAPI
+
+from app.core.health import health_router
+from benchmarks.run import (
+    compare,
+    find_errors,
+)
+from benchmarks.targets import ASGITarget
+
+
+def make_report(**results: dict) -> dict:
+    return {
+        "results": [
+            {
+                "kind": "load",
+                "key": key,
+                "requests": 100,
+                "errors": 0,
+                "rps": 100.0,
+                "p95_ms": 10.0,
+                "p99_ms": 20.0,
+                **result,
+            }
+            for key, result in results.items()
+        ]
+    }
+
+
+def test_compare():
+    baseline = make_report(read={}, write={})
+    report = make_report(read={"rps": 95.0}, write={"p99_ms": 30.0})
+    assert compare(baseline, report, tolerance=0.1) == [
+        "write p99_ms: 20.00 -> 30.00 (+50.0% worse)"
+    ]
+
+
+def test_errors_fail_fast_scenarios():
+    baseline = make_report(read={})
+    report = make_report(read={"errors": 100, "rps": 1000.0, "p99_ms": 1.0})
+    assert compare(baseline, report, tolerance=0.1) == []
+    assert find_errors(report) == ["read: 100 of 100 requests failed"]
+    assert find_errors(baseline) == []
+
+
+async def test_target_waits_until_ready():
+    app = FastAPI()
+    app.include_router(health_router)
+    app.state.ready = False
+
+    async def warm_up() -> None:
+        await asyncio.sleep(0.05)
+        app.state.ready = True
+
+    @app.on_event("startup")
+    async def start_warming_up() -> None:
+        app.state.warm_up = asyncio.create_task(warm_up())
+
+    async with ASGITarget(app, concurrency=1):
+        assert app.state.ready
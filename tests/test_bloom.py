@@ -0,0 +1,54 @@
+import typing as ty
+
+from app.core.bloom import (
+    BloomFilter,
+    rebuild_filters,
+)
+
+
+def make_rows(*rows: tuple[str | None, ...]):
+    async def iter_rows() -> ty.AsyncIterator[list[tuple[str | None, ...]]]:
+        yield list(rows)
+
+    return iter_rows
+
+
+async def test_missing_filter_might_contain_anything(cache):
+    bloom = BloomFilter("names", capacity=100, error_rate=0.01)
+    assert not await bloom.exists(cache)
+    assert await bloom.might_contain(cache, ["alice"]) == [True]
+
+
+async def test_disabled_filter_might_contain_anything(cache):
+    bloom = BloomFilter("names", capacity=0, error_rate=0.01)
+    await bloom.add(cache, ["alice"])
+    assert await bloom.exists(cache)
+    assert await bloom.might_contain(cache, ["bob"]) == [True]
+
+
+async def test_add_and_check(cache):
+    bloom = BloomFilter("names", capacity=100, error_rate=0.01)
+    assert await rebuild_filters(cache, [bloom], make_rows())
+    assert await bloom.might_contain(cache, ["alice", "bob"]) == [
+        False,
+        False,
+    ]
+    await bloom.add(cache, ["alice"])
+    assert await bloom.might_contain(cache, ["alice", "bob"]) == [
+        True,
+        False,
+    ]
+
+
+async def test_rebuild_filters(cache):
+    ids = BloomFilter("ids", capacity=100, error_rate=0.01)
+    names = BloomFilter("names", capacity=100, error_rate=0.01)
+    assert await rebuild_filters(
+        cache, [ids, names], make_rows(("1", "alice"), (None, "bob"))
+    )
+    assert await ids.might_contain(cache, ["1", "2"]) == [True, False]
+    assert await names.might_contain(cache, ["alice", "bob", "carol"]) == [
+        True,
+        True,
+        False,
+    ]
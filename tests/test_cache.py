@@ -0,0 +1,296 @@
+import asyncio
+import gzip
+import time
+import typing as ty
+from datetime import (
+    datetime,
+    timezone,
+)
+from types import SimpleNamespace
+from unittest import mock
+
+import pydantic
+from starlette import status
+from starlette.exceptions import HTTPException
+
+from app.core.cache import (
+    COMPRESS_MIN_SIZE,
+    LOCK_TIMEOUT,
+    BatchingRedis,
+    CacheEntry,
+    LocalCache,
+    bump_generation,
+    cached,
+    get_generation,
+    get_hot_keys,
+    listen_invalidations,
+    make_cache_key,
+    resets_cache,
+    writes_cache,
+)
+
+
+class Value(pydantic.BaseModel):
+    value: int
+
+
+def make_endpoint(
+    calls: list[int],
+    delay: float = 0.0,
+    status_code: int | None = None,
+    **kwargs,
+):
+    """Cached endpoint, as every worker of an application has one."""
+
+    async def read_value(request, id: int):
+        calls.append(id)
+        await asyncio.sleep(delay)
+        if status_code is not None:
+            raise HTTPException(status_code, "Failed")
+        return Value(value=id)
+
+    return cached(prefix="value", ttl=60, **kwargs)(read_value)
+
+
+async def test_caches_result(make_request):
+    calls: list[int] = []
+    read_value = make_endpoint(calls)
+    assert await read_value(request=make_request(), id=1) == {"value": 1}
+    assert await read_value(request=make_request(), id=1) == {"value": 1}
+    assert await read_value(request=make_request(), id=2) == {"value": 2}
+    assert calls == [1, 2]
+
+
+async def test_coalesces_concurrent_misses(make_request):
+    calls: list[int] = []
+    read_value = make_endpoint(calls, delay=0.05)
+    results = await asyncio.gather(
+        *(read_value(request=make_request(), id=1) for _ in range(10))
+    )
+    assert results == [{"value": 1}] * 10
+    assert calls == [1]
+
+
+async def test_waits_for_other_worker(make_request):
+    calls: list[int] = []
+    workers = [make_endpoint(calls, delay=0.1) for _ in range(2)]
+    results = await asyncio.gather(
+        *(read_value(request=make_request(), id=1) for read_value in workers)
+    )
+    assert results == [{"value": 1}] * 2
+    assert calls == [1]
+
+
+async def test_stops_waiting_when_other_worker_fails(make_request):
+    calls: list[int] = []
+    workers = [
+        make_endpoint(calls, delay=0.1, status_code=400) for _ in range(2)
+    ]
+    started_at = time.monotonic()
+    results = await asyncio.gather(
+        *(read_value(request=make_request(), id=1) for read_value in workers),
+        return_exceptions=True,
+    )
+    assert time.monotonic() - started_at < LOCK_TIMEOUT / 2
+    assert [
+        error.status_code
+        for error in results
+        if isinstance(error, HTTPException)
+    ] == [status.HTTP_400_BAD_REQUEST] * 2
+    # Errors are not cached, every worker gets its own.
+    assert calls == [1, 1]
+
+
+async def test_records_hot_keys_in_background(make_request, cache):
+    read_value = make_endpoint([], hot_keys_sample_rate=1.0)
+    for id in (1, 2, 2):
+        await read_value(request=make_request(), id=id)
+    # Give the background tasks a chance to run.
+    await asyncio.sleep(0.01)
+    assert await get_hot_keys(cache, "value", 2) == [
+        make_cache_key(prefix="value", id=2),
+        make_cache_key(prefix="value", id=1),
+    ]
+
+
+async def test_bump_generation(cache):
+    local_cache = LocalCache(max_size=10, ttl=60)
+    assert await get_generation(cache, "value", local_cache) == 0
+    await bump_generation(cache, "value", local_cache)
+    assert await get_generation(cache, "value", local_cache) == 1
+    assert await get_generation(cache, "value") == 1
+
+
+async def test_batches_commands_of_a_tick(cache):
+    assert isinstance(cache, BatchingRedis)
+    await cache.set("a", 1)
+    with mock.patch.object(cache, "_send", wraps=cache._send) as send:
+        results = await asyncio.gather(
+            cache.get("a"), cache.incr("a"), cache.get("b")
+        )
+        assert results == [b"1", 2, None]
+        assert await cache.get("a") == b"2"
+    assert [len(call.args[0]) for call in send.call_args_list] == [3, 1]
+
+
+async def wait_for_eviction(local_cache: LocalCache, key: str) -> None:
+    while local_cache.get(key) is not None:
+        await asyncio.sleep(0.01)
+
+
+async def test_invalidates_local_caches_of_all_workers(make_request, cache):
+    local_caches = [LocalCache(max_size=10, ttl=60) for _ in range(2)]
+    listeners = [
+        asyncio.create_task(listen_invalidations(cache, local_cache))
+        for local_cache in local_caches
+    ]
+    # Let the listeners subscribe.
+    await asyncio.sleep(0.01)
+    try:
+        calls: list[int] = []
+        read_value = make_endpoint(calls, local=True)
+
+        @resets_cache(prefix="value")
+        async def delete_value(request, id: int):
+            pass
+
+        for local_cache in local_caches:
+            await read_value(
+                request=make_request(local_cache=local_cache), id=1
+            )
+            assert await get_generation(cache, "value", local_cache) == 0
+        assert calls == [1]
+
+        # A reset in the first worker evicts the value in the second.
+        request = make_request(local_cache=local_caches[0])
+        hooks: list[ty.Callable[[], ty.Awaitable[None]]] = []
+        request.state.db = SimpleNamespace(on_commit=hooks.append)
+        await delete_value(request=request, id=1)
+        [reset] = hooks
+        await reset()
+        await asyncio.wait_for(
+            wait_for_eviction(
+                local_caches[1], make_cache_key(prefix="value", id=1)
+            ),
+            1.0,
+        )
+        await read_value(
+            request=make_request(local_cache=local_caches[1]), id=1
+        )
+        assert calls == [1, 1]
+
+        # So does a generation bump.
+        await bump_generation(cache, "value", local_caches[0])
+        await asyncio.wait_for(
+            wait_for_eviction(local_caches[1], "generation_value"), 1.0
+        )
+        assert await get_generation(cache, "value", local_caches[1]) == 1
+    finally:
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+
+
+def test_entry_round_trip():
+    entry = CacheEntry.unpack(CacheEntry(b'{"value":1}').pack())
+    assert entry.body == b'{"value":1}'
+    assert not entry.compressed
+    assert not entry.tombstone
+    assert entry.last_modified is None
+
+
+def test_compressed_entry_round_trip():
+    body = b'{"value":"' + b"x" * COMPRESS_MIN_SIZE + b'"}'
+    entry = CacheEntry.unpack(
+        CacheEntry.from_body(body, compress=True, last_modified=1).pack()
+    )
+    assert entry.compressed
+    assert len(entry.body) < len(body)
+    assert entry.decompressed() == body
+    assert entry.last_modified == 1
+
+
+def test_small_entry_is_not_compressed():
+    entry = CacheEntry.from_body(b'{"value":1}', compress=True)
+    assert not entry.compressed
+    assert entry.decompressed() == b'{"value":1}'
+
+
+def test_tombstone_round_trip():
+    entry = CacheEntry.unpack(CacheEntry(b"", tombstone=True).pack())
+    assert entry.tombstone
+    assert entry.body == b""
+
+
+def test_legacy_value_is_unpacked_as_body():
+    for body in [b'{"value":1}', b"[]", b'"value"']:
+        entry = CacheEntry.unpack(body)
+        assert entry.body == body
+        assert not entry.compressed
+
+
+async def test_raw_hit_is_sent_as_cached(make_request):
+    calls: list[int] = []
+    read_value = make_endpoint(calls, raw=True)
+    first = await read_value(request=make_request(), id=1)
+    second = await read_value(request=make_request(), id=1)
+    assert first.body == second.body == b'{"value": 1}'
+    assert second.media_type == "application/json"
+    assert calls == [1]
+
+
+class Text(pydantic.BaseModel):
+    text: str
+
+
+async def test_compressed_hit_is_sent_as_accepted(make_request):
+    @cached(prefix="text", ttl=60, raw=True, compress=True)
+    async def read_text(request, size: int):
+        return Text(text="x" * size)
+
+    body = Text(text="x" * COMPRESS_MIN_SIZE).json().encode()
+    await read_text(request=make_request(), size=COMPRESS_MIN_SIZE)
+    plain = await read_text(request=make_request(), size=COMPRESS_MIN_SIZE)
+    assert plain.body == body
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["vary"] == "Accept-Encoding"
+    compressed = await read_text(
+        request=make_request({"Accept-Encoding": "gzip, br"}),
+        size=COMPRESS_MIN_SIZE,
+    )
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(compressed.body) == body
+
+
+class Stamped(pydantic.BaseModel):
+    value: int
+    updated_at: datetime
+
+
+async def test_write_through_never_goes_backwards(make_request):
+    @writes_cache(
+        prefix="value",
+        significant_args=["id"],
+        ttl=60,
+        last_modified=lambda result: result.updated_at,
+    )
+    async def write_value(request, id: int, value: int):
+        return Stamped(
+            value=value,
+            updated_at=datetime.fromtimestamp(1000 + value, timezone.utc),
+        )
+
+    hooks: list[ty.Callable[[], ty.Awaitable[None]]] = []
+    for value in (1, 2):
+        request = make_request()
+        request.state.db = SimpleNamespace(on_commit=hooks.append)
+        await write_value(request=request, id=1, value=value)
+    # The older update is committed last.
+    for hook in reversed(hooks):
+        await hook()
+
+    calls: list[int] = []
+    read_value = make_endpoint(calls, raw=True)
+    response = await read_value(request=make_request(), id=1)
+    assert Stamped.parse_raw(response.body).value == 2
+    assert calls == []
@@ -0,0 +1,101 @@
+import typing as ty
+from datetime import datetime
+
+import pytest
+
+from app.core import formats
+
+
+async def stream(*chunks: bytes) -> ty.AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def parse(
+    media_type: str,
+    *chunks: bytes,
+    batch_size: int = 100,
+) -> list[list[tuple[int, formats.Record | None]]]:
+    return [
+        batch
+        async for batch in formats.iter_record_batches(
+            stream(*chunks), media_type, batch_size=batch_size
+        )
+    ]
+
+
+async def test_iter_lines_across_chunks():
+    text = "first\nsecond line\nthird é\n"
+    encoded = text.encode()
+    # Split in the middle of the two-byte character too.
+    chunks = [encoded[i : i + 3] for i in range(0, len(encoded), 3)]
+    lines = [line async for line in formats.iter_lines(stream(*chunks))]
+    assert lines == ["first", "second line", "third é"]
+
+
+async def test_iter_lines_without_trailing_newline():
+    lines = [line async for line in formats.iter_lines(stream(b"a\nb"))]
+    assert lines == ["a", "b"]
+
+
+async def test_parse_ndjson():
+    batches = await parse(
+        formats.NDJSON,
+        b'{"name": "a"}\n\n',
+        b'not json\n[1, 2]\r\n{"name": "b"}',
+    )
+    assert batches == [
+        [(1, {"name": "a"}), (2, None), (3, None), (4, {"name": "b"})]
+    ]
+
+
+async def test_parse_csv():
+    batches = await parse(
+        formats.CSV,
+        b"name,email\r\n",
+        b'a,a@example.com\r\n"b, c",b@example.com\n',
+        b'd\n"e,e@example.com\nf,f@example.com\n',
+    )
+    assert batches == [
+        [
+            (1, {"name": "a", "email": "a@example.com"}),
+            (2, {"name": "b, c", "email": "b@example.com"}),
+            (3, None),
+            # A stray quote spoils only its own line.
+            (4, None),
+            (5, {"name": "f", "email": "f@example.com"}),
+        ]
+    ]
+
+
+async def test_parse_in_batches():
+    body = b"".join(b'{"id": %d}\n' % i for i in range(5))
+    batches = await parse(formats.NDJSON, body, batch_size=2)
+    assert [[row_no for row_no, _ in batch] for batch in batches] == [
+        [1, 2],
+        [3, 4],
+        [5],
+    ]
+
+
+async def test_parse_unsupported_format():
+    with pytest.raises(formats.UnsupportedFormat):
+        await parse("application/json", b"[]")
+
+
+def test_encode_ndjson():
+    records = [{"id": 1, "created_at": datetime(2022, 1, 2, 3, 4, 5)}]
+    assert formats.encode_ndjson(records) == (
+        b'{"id": 1, "created_at": "2022-01-02T03:04:05"}\n'
+    )
+
+
+def test_encode_csv():
+    records = [
+        {"id": 1, "name": "a, b", "created_at": datetime(2022, 1, 2)},
+    ]
+    columns = ["id", "name", "created_at"]
+    assert formats.encode_csv_header(columns) == b"id,name,created_at\r\n"
+    assert formats.encode_csv(records, columns) == (
+        b'1,"a, b",2022-01-02T00:00:00\r\n'
+    )
@@ -0,0 +1,34 @@
+import asyncio
+from unittest import mock
+
+from fastapi import FastAPI
+from starlette import status
+
+from app.core import health
+from app.settings import settings
+
+
+async def test_live(client):
+    response = await client.get("/health/live")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+
+async def test_ready_once_warm(app, client):
+    assert app.state.ready
+    response = await client.get("/health/ready")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+
+async def test_not_ready_while_draining(app, client, monkeypatch):
+    monkeypatch.setattr(app.state, "draining", True, raising=False)
+    response = await client.get("/health/ready")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+async def test_ready_once_warm_up_gives_up(monkeypatch):
+    app = FastAPI()
+    monkeypatch.setattr(settings, "warm_up_timeout", 0.05)
+    monkeypatch.setattr(health, "WARM_UP_RETRY_DELAY", 0.01)
+    with mock.patch.object(health, "_warm_up", side_effect=RuntimeError):
+        await asyncio.wait_for(health.warm_up(app), 1.0)
+    assert app.state.ready
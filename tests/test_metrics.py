@@ -0,0 +1,11 @@
+from starlette import status
+
+
+async def test_metrics(client):
+    await client.get("/health/live")
+    await client.get("/api/users/unknown")
+    response = await client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert "query_compile_cache_total" in response.text
+    assert 'route="/health/live",status="2xx"' in response.text
+    assert 'route="/api/users/{id}",status="4xx"' in response.text
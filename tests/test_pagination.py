@@ -0,0 +1,53 @@
+import pytest
+from starlette.datastructures import URL
+
+from app.core.pagination import (
+    MAX_CURSOR,
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+    make_link_header,
+)
+
+
+@pytest.mark.parametrize("id", [0, 1, 255, 256, 70_000, MAX_CURSOR])
+def test_cursor_round_trip(id):
+    assert decode_cursor(encode_cursor(id)) == id
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "",
+        "0OIl",
+        encode_cursor(MAX_CURSOR + 1),
+        encode_cursor(2**32),
+        encode_cursor(2**63 - 1),
+    ],
+)
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_link_header():
+    url = URL("http://test/api/users/?limit=2&offset=4")
+    link = make_link_header(
+        url, first_id=5, last_id=6, has_next=True, has_previous=True
+    )
+    assert link == (
+        f"<http://test/api/users/?limit=2&after={encode_cursor(6)}>; "
+        'rel="next", '
+        f"<http://test/api/users/?limit=2&before={encode_cursor(5)}>; "
+        'rel="prev"'
+    )
+
+
+def test_link_header_of_single_page():
+    url = URL("http://test/api/users/")
+    assert (
+        make_link_header(
+            url, first_id=1, last_id=2, has_next=False, has_previous=False
+        )
+        == ""
+    )
@@ -0,0 +1,87 @@
+import typing as ty
+
+import pytest
+from starlette import status
+
+import app.api  # noqa: F401 Registers the statements.
+from app.core.events import create_engine
+from app.core.queries import queries
+from app.core.session import LazyConnection
+from tests.fixtures import DB_URL
+
+PARAMS: dict[str, dict[str, ty.Any]] = {
+    "authenticate": {"name": "alice", "password_hash": ""},
+    "count_users": {},
+    "create_user": {
+        "name": "alice",
+        "email": "alice@example.com",
+        "password_hash": "",
+    },
+    "estimate_users": {"index": "ix_user_active_id"},
+    "find_user_by_name_or_email": {
+        "name": "alice",
+        "email": "alice@example.com",
+    },
+    "list_users": {"limit": 10, "offset": 0},
+    "list_users_after": {"cursor": 0, "limit": 10},
+    "list_users_before": {"cursor": 100, "limit": 10},
+    "read_user": {"id": 1},
+    "read_users": {"ids": [1, 2]},
+}
+
+
+@pytest.fixture
+async def db() -> ty.AsyncIterator[LazyConnection]:
+    engine = create_engine(DB_URL)
+    queries.compile(engine.dialect)
+    db = LazyConnection(engine)
+    try:
+        yield db
+    finally:
+        await db.rollback()
+        await db.close()
+        await engine.dispose()
+
+
+def test_every_statement_is_tested():
+    assert sorted(queries) == sorted(PARAMS)
+
+
+@pytest.mark.parametrize("name", sorted(PARAMS))
+async def test_execute(db, name):
+    await queries.execute(db, name, **PARAMS[name])
+
+
+async def test_warm_up(db):
+    await queries.warm_up(db)
+
+
+async def test_count_prepared_statement_reuse(db):
+    hits = queries.stats.prepared_hits
+    misses = queries.stats.prepared_misses
+    await queries.execute(db, "read_user", id=1)
+    await queries.execute(db, "read_user", id=2)
+    assert queries.stats.prepared_misses == misses + 1
+    assert queries.stats.prepared_hits == hits + 1
+
+
+async def test_requests_run_precompiled_statements(client):
+    misses = queries.stats.compile_misses
+    hits = queries.stats.compile_hits
+    response = await client.post(
+        "/api/users/",
+        json={
+            "name": "alice",
+            "email": "alice@example.com",
+            "password": "password",
+        },
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    for _ in range(2):
+        response = await client.post(
+            "/api/auth", data={"username": "alice", "password": "password"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+    # Compiled at startup, not per request.
+    assert queries.stats.compile_misses == misses
+    assert queries.stats.compile_hits >= hits + 3
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import orjson
+import pytest
+from starlette.datastructures import Headers
+
+from app.core.responses import (
+    encode_rows,
+    format_http_date,
+    is_not_modified,
+    make_cache_control,
+    make_etag,
+    to_timestamp,
+)
+
+ETAG = make_etag("abc")
+MODIFIED_AT = to_timestamp(datetime(2022, 8, 3, 12))
+
+
+def test_encode_rows():
+    rows = [
+        {"id": 1, "name": "alice", "created_at": datetime(2022, 8, 3, 12)},
+        {"id": 2, "name": "bob", "created_at": datetime(2022, 8, 4, 12)},
+    ]
+    assert orjson.loads(encode_rows(rows, ["id", "created_at"])) == [
+        {"id": 1, "created_at": "2022-08-03T12:00:00"},
+        {"id": 2, "created_at": "2022-08-04T12:00:00"},
+    ]
+
+
+@pytest.mark.parametrize(
+    "max_age, stale_while_revalidate, expected",
+    [
+        (0, 0, "no-cache"),
+        (0, 30, "no-cache"),
+        (60, 0, "public, max-age=60"),
+        (60, 30, "public, max-age=60, stale-while-revalidate=30"),
+    ],
+)
+def test_make_cache_control(max_age, stale_while_revalidate, expected):
+    assert make_cache_control(max_age, stale_while_revalidate) == expected
+
+
+def test_http_date():
+    assert format_http_date(MODIFIED_AT) == "Wed, 03 Aug 2022 12:00:00 GMT"
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({}, False),
+        ({"If-None-Match": ETAG}, True),
+        ({"If-None-Match": '"abc"'}, True),
+        ({"If-None-Match": 'W/"other", W/"abc"'}, True),
+        ({"If-None-Match": "*"}, True),
+        ({"If-None-Match": 'W/"other"'}, False),
+        ({"If-Modified-Since": "Wed, 03 Aug 2022 12:00:00 GMT"}, True),
+        ({"If-Modified-Since": "Thu, 04 Aug 2022 12:00:00 GMT"}, True),
+        ({"If-Modified-Since": "Tue, 02 Aug 2022 12:00:00 GMT"}, False),
+        ({"If-Modified-Since": "not a date"}, False),
+        # The entity tag wins over the date.
+        (
+            {
+                "If-None-Match": 'W/"other"',
+                "If-Modified-Since": "Wed, 03 Aug 2022 12:00:00 GMT",
+            },
+            False,
+        ),
+    ],
+)
+def test_is_not_modified(headers, expected):
+    assert is_not_modified(Headers(headers), ETAG, MODIFIED_AT) is expected
+
+
+def test_is_modified_without_date():
+    headers = Headers({"If-Modified-Since": "Wed, 03 Aug 2022 12:00:00 GMT"})
+    assert not is_not_modified(headers, ETAG)
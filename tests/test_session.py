@@ -0,0 +1,85 @@
+import typing as ty
+from unittest import mock
+
+import httpx
+import pytest
+import sqlalchemy as sa
+from fastapi import (
+    FastAPI,
+    Request,
+)
+from starlette import status
+
+from app.core import session
+from app.core.events import create_engine
+from app.core.session import (
+    READ_PRIMARY_COOKIE,
+    DatabaseRouter,
+    DBSessionMiddleware,
+)
+from tests.fixtures import DB_URL
+
+
+@pytest.fixture
+async def router() -> ty.AsyncIterator[DatabaseRouter]:
+    # The replica is the same database, through an engine of its own.
+    router = DatabaseRouter(create_engine(DB_URL), [create_engine(DB_URL)])
+    try:
+        yield router
+    finally:
+        await router.dispose()
+
+
+@pytest.fixture
+async def client(router) -> ty.AsyncIterator[httpx.AsyncClient]:
+    """Client of an application telling how it queried the database."""
+    app = FastAPI()
+    app.state.db_router = router
+    app.add_middleware(DBSessionMiddleware, read_your_writes_window=60)
+
+    @app.api_route("/", methods=["GET", "POST"])
+    async def describe(request: Request, query: bool = True):
+        db = request.state.db
+        if not query:
+            return {}
+        read_only = await db.scalar(sa.text("SHOW transaction_read_only"))
+        return {
+            "primary": db.engine is router.primary,
+            "read_only": read_only == "on",
+        }
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+async def test_connects_on_first_query(client):
+    with mock.patch.object(
+        session.metrics, "observe_checkout"
+    ) as observe_checkout:
+        response = await client.get("/", params={"query": False})
+        assert response.status_code == status.HTTP_200_OK
+        observe_checkout.assert_not_called()
+        response = await client.get("/")
+        assert response.status_code == status.HTTP_200_OK
+    observe_checkout.assert_called_once()
+
+
+async def test_reads_are_read_only(client):
+    response = await client.get("/")
+    assert response.json()["read_only"] is True
+    response = await client.post("/")
+    assert response.json()["read_only"] is False
+
+
+async def test_reads_own_writes_from_primary(client):
+    response = await client.get("/")
+    assert response.json()["primary"] is False
+    assert READ_PRIMARY_COOKIE not in response.cookies
+    response = await client.post("/")
+    assert response.json()["primary"] is True
+    assert READ_PRIMARY_COOKIE in response.cookies
+    # The client sends the cookie back.
+    response = await client.get("/")
+    assert response.json()["primary"] is True
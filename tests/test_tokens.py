@@ -0,0 +1,99 @@
+import asyncio
+import contextlib
+import time
+from unittest import mock
+
+import pytest
+
+from app.core.tokens import (
+    InvalidToken,
+    TokenSigner,
+)
+
+
+@pytest.fixture
+def signer() -> TokenSigner:
+    return TokenSigner(secret="secret", key_version=1, ttl=60)
+
+
+def test_verify_issued_token(signer):
+    assert signer.verify(signer.issue(42)) == 42
+
+
+def test_tokens_are_unique(signer):
+    assert signer.issue(42) != signer.issue(42)
+
+
+@pytest.mark.parametrize("token", ["", "x", "not a token!", "A" * 64])
+def test_reject_malformed_token(signer, token):
+    with pytest.raises(InvalidToken):
+        signer.verify(token)
+
+
+def test_reject_tampered_token(signer):
+    token = signer.issue(42)
+    tampered = ("B" if token[0] == "A" else "A") + token[1:]
+    with pytest.raises(InvalidToken, match="signature"):
+        signer.verify(tampered)
+
+
+def test_reject_token_of_other_secret(signer):
+    other = TokenSigner(secret="other", key_version=1, ttl=60)
+    with pytest.raises(InvalidToken, match="signature"):
+        signer.verify(other.issue(42))
+
+
+def test_reject_token_of_outdated_key(signer):
+    rotated = TokenSigner(secret="secret", key_version=2, ttl=60)
+    token = signer.issue(42)
+    with pytest.raises(InvalidToken):
+        rotated.verify(token)
+
+
+def test_reject_expired_token(signer):
+    token = signer.issue(42)
+    with mock.patch("time.time", return_value=time.time() + 61):
+        with pytest.raises(InvalidToken, match="Expired"):
+            signer.verify(token)
+
+
+async def test_revoke_token(signer, cache):
+    token = signer.issue(42)
+    other_token = signer.issue(42)
+    await signer.revoke(token, cache=cache)
+    with pytest.raises(InvalidToken, match="Revoked"):
+        signer.verify(token)
+    assert signer.verify(other_token) == 42
+
+
+async def test_revoke_user(signer, cache):
+    token = signer.issue(42)
+    other_user_token = signer.issue(43)
+    await signer.revoke_user(42, cache=cache)
+    with pytest.raises(InvalidToken, match="Revoked"):
+        signer.verify(token)
+    assert signer.verify(other_user_token) == 43
+    # Issued once the ones before expired, so after the revocation.
+    with mock.patch("time.time", return_value=time.time() + 61):
+        assert signer.verify(signer.issue(42)) == 42
+
+
+async def test_sync_revocations(signer, cache):
+    other_worker = TokenSigner(secret="secret", key_version=1, ttl=60)
+    token = signer.issue(42)
+    user_token = signer.issue(43)
+    await signer.revoke(token, cache=cache)
+    await signer.revoke_user(43, cache=cache)
+    sync = asyncio.create_task(
+        other_worker.sync_revocations(cache, interval=0.01)
+    )
+    try:
+        await asyncio.sleep(0.05)
+        with pytest.raises(InvalidToken, match="Revoked"):
+            other_worker.verify(token)
+        with pytest.raises(InvalidToken, match="Revoked"):
+            other_worker.verify(user_token)
+    finally:
+        sync.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await sync
@@ -0,0 +1,498 @@
+import csv
+import io
+import json
+import re
+from unittest import mock
+
+import pytest
+from starlette import status
+
+from app.api.filters import (
+    USER_FILTERS,
+    add_users,
+)
+from app.api.users import (
+    MAX_FIELD_LENGTH,
+    USER_COUNT_KEY,
+)
+from app.core import formats
+from app.core.bloom import rebuild_filters
+from app.core.pagination import encode_cursor
+from app.core.queries import queries
+from app.core.tokens import TokenSigner
+from app.settings import settings
+
+
+async def create_user(client, name: str, password: str = "password"):
+    response = await client.post(
+        "/api/users/",
+        json={
+            "name": name,
+            "email": f"{name}@example.com",
+            "password": password,
+        },
+    )
+    assert response.status_code == status.HTTP_201_CREATED, response.text
+    return response.json()
+
+
+async def log_in(client, name: str, password: str = "password") -> dict:
+    response = await client.post(
+        "/api/auth", data={"username": name, "password": password}
+    )
+    assert response.status_code == status.HTTP_200_OK, response.text
+    token = response.json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def test_create_user(client):
+    user = await create_user(client, "alice")
+    assert user["name"] == "alice"
+    assert user["email"] == "alice@example.com"
+    response = await client.get(f"/api/users/{user['id']}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == user
+
+
+async def test_read_user_not_modified(client):
+    user = await create_user(client, "alice")
+    response = await client.get(f"/api/users/{user['id']}")
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+    assert "Cache-Control" in response.headers
+    for headers in [
+        {"If-None-Match": etag},
+        {"If-Modified-Since": last_modified},
+    ]:
+        response = await client.get(
+            f"/api/users/{user['id']}", headers=headers
+        )
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.headers["ETag"] == etag
+        assert not response.content
+    response = await client.patch(
+        f"/api/users/{user['id']}",
+        json={"email": "a@example.com"},
+        headers=await log_in(client, "alice"),
+    )
+    assert response.status_code == status.HTTP_200_OK
+    response = await client.get(
+        f"/api/users/{user['id']}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["ETag"] != etag
+
+
+async def test_list_users_not_modified(client):
+    await create_user(client, "alice")
+    response = await client.get("/api/users/")
+    etag = response.headers["ETag"]
+    response = await client.get("/api/users/", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    await create_user(client, "bob")
+    response = await client.get("/api/users/", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()) == 2
+
+
+async def list_links(client, **params) -> tuple[list[str], set[str]]:
+    response = await client.get("/api/users/", params=params)
+    assert response.status_code == status.HTTP_200_OK
+    return (
+        [user["name"] for user in response.json()],
+        set(re.findall(r'rel="(\w+)"', response.headers.get("Link", ""))),
+    )
+
+
+async def test_list_users_pages(client):
+    users = [await create_user(client, name) for name in ("a", "b", "c")]
+    assert await list_links(client, limit=3) == (["a", "b", "c"], set())
+    after = encode_cursor(users[0]["id"])
+    assert await list_links(client, limit=2, after=after) == (
+        ["b", "c"],
+        {"prev"},
+    )
+    # Cached pages link the same.
+    for _ in range(2):
+        before = encode_cursor(users[2]["id"])
+        assert await list_links(client, limit=2, before=before) == (
+            ["a", "b"],
+            {"next"},
+        )
+        assert await list_links(client, limit=1, before=before) == (
+            ["b"],
+            {"next", "prev"},
+        )
+
+
+async def test_authenticate(client):
+    user = await create_user(client, "alice")
+    headers = await log_in(client, "alice")
+    response = await client.patch(
+        f"/api/users/{user['id']}", json={"email": "a@example.com"}
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    response = await client.patch(
+        f"/api/users/{user['id']}",
+        json={"email": "a@example.com"},
+        headers=headers,
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["email"] == "a@example.com"
+
+
+async def test_authenticate_with_wrong_password(client):
+    await create_user(client, "alice")
+    response = await client.post(
+        "/api/auth", data={"username": "alice", "password": "wrong"}
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_authenticate_unknown_name(app, client):
+    with mock.patch.object(
+        app.state.crypto, "hash_password", wraps=app.state.crypto.hash_password
+    ) as hash_password:
+        response = await client.post(
+            "/api/auth", data={"username": "nobody", "password": "password"}
+        )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    # Unknown names take as long as wrong passwords.
+    hash_password.assert_awaited_once_with("password")
+
+
+async def test_failed_login_is_cached(client):
+    await create_user(client, "alice")
+    with mock.patch(
+        "app.api.auth.queries.execute", wraps=queries.execute
+    ) as execute:
+        for _ in range(2):
+            response = await client.post(
+                "/api/auth", data={"username": "alice", "password": "wrong"}
+            )
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert execute.await_count == 1
+
+
+async def test_create_user_fails_without_filters(client):
+    with mock.patch("app.api.users.add_users", side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            await create_user(client, "alice")
+    # Nothing was committed.
+    await create_user(client, "alice")
+
+
+async def test_create_user_during_filter_rebuild(client):
+    async def scan_before_commit():
+        # An empty chunk, nothing is committed yet.
+        yield []
+
+    async def add_then_rebuild(cache, users):
+        await add_users(cache, users)
+        if not rebuilt:
+            # The rebuild's scan cannot see the uncommitted user.
+            rebuilt.append(
+                await rebuild_filters(cache, USER_FILTERS, scan_before_commit)
+            )
+
+    rebuilt: list[bool] = []
+    with mock.patch("app.api.users.add_users", side_effect=add_then_rebuild):
+        await create_user(client, "alice")
+    assert rebuilt == [True]
+    await log_in(client, "alice")
+
+
+async def test_create_user_with_taken_name(client):
+    await create_user(client, "alice")
+    response = await client.post(
+        "/api/users/",
+        json={
+            "name": "alice",
+            "email": "other@example.com",
+            "password": "password",
+        },
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_delete_user(client):
+    # The longest non-ASCII name whose email fits.
+    name = "é" * (MAX_FIELD_LENGTH - len("@example.com"))
+    user = await create_user(client, name)
+    response = await client.delete(
+        f"/api/users/{user['id']}", headers=await log_in(client, name)
+    )
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    response = await client.get(f"/api/users/{user['id']}")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    # The tombstone is sent as the error of a user never created.
+    missing = await client.get(f"/api/users/{user['id'] + 1}")
+    assert missing.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == missing.json()
+    # Names of deleted users are free again.
+    await create_user(client, name)
+
+
+@pytest.mark.parametrize("token_mode", ["redis", "signed"])
+async def test_deleted_user_tokens_are_revoked(
+    app, client, monkeypatch, token_mode
+):
+    monkeypatch.setattr(settings, "token_mode", token_mode)
+    monkeypatch.setattr(
+        app.state,
+        "tokens",
+        TokenSigner(secret="secret", key_version=1, ttl=60),
+        raising=False,
+    )
+    user = await create_user(client, "alice")
+    headers = await log_in(client, "alice")
+    other_headers = await log_in(client, "alice")
+    response = await client.delete(f"/api/users/{user['id']}", headers=headers)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    response = await client.patch(
+        f"/api/users/{user['id']}",
+        json={"email": "a@example.com"},
+        headers=other_headers,
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+async def test_update_deleted_user(client):
+    user = await create_user(client, "alice")
+    headers = await log_in(client, "alice")
+    with mock.patch("app.api.users.revoke_user_tokens"):
+        response = await client.delete(
+            f"/api/users/{user['id']}", headers=headers
+        )
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    response = await client.patch(
+        f"/api/users/{user['id']}",
+        json={"email": "a@example.com"},
+        headers=headers,
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = await client.get(f"/api/users/{user['id']}")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_create_user_with_too_long_name(client):
+    response = await client.post(
+        "/api/users/",
+        json={
+            "name": "x" * (MAX_FIELD_LENGTH + 1),
+            "email": "x@example.com",
+            "password": "password",
+        },
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def count_users(client, total: str = "counter") -> int:
+    response = await client.get("/api/users/", params={"total": total})
+    assert response.status_code == status.HTTP_200_OK
+    return int(response.headers["X-Total-Count"])
+
+
+async def test_count_users(client):
+    alice = await create_user(client, "alice")
+    assert await count_users(client) == 1
+    await create_user(client, "bob")
+    assert await count_users(client) == 2
+    response = await client.delete(
+        f"/api/users/{alice['id']}", headers=await log_in(client, "alice")
+    )
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert await count_users(client) == 1
+    assert await count_users(client, "exact") == 1
+
+
+async def test_estimate_users_before_analyze(client):
+    # The index of a table never analyzed estimates it empty.
+    await create_user(client, "alice")
+    await create_user(client, "bob")
+    assert await count_users(client, "estimate") == 2
+
+
+async def test_count_users_on_commit(client, cache):
+    await create_user(client, "alice")
+    assert await count_users(client) == 1
+    with mock.patch(
+        "app.api.users.forget_failed_logins", side_effect=RuntimeError
+    ):
+        with pytest.raises(RuntimeError):
+            await create_user(client, "bob")
+    assert await count_users(client) == 1
+    assert int(await cache.get(USER_COUNT_KEY)) == 1
+
+
+async def search_users(client, q: str, match: str = "prefix") -> list[str]:
+    response = await client.get(
+        "/api/users/search", params={"q": q, "match": match}
+    )
+    assert response.status_code == status.HTTP_200_OK, response.text
+    return [user["name"] for user in response.json()]
+
+
+async def test_search_users(client):
+    await create_user(client, "alice")
+    await create_user(client, "bob")
+    assert await search_users(client, "AL") == ["alice"]
+    assert await search_users(client, "lic", "substring") == ["alice"]
+    assert await search_users(client, "b") == ["bob"]
+    assert await search_users(client, "%") == []
+
+
+async def test_search_short_substring(client):
+    response = await client.get(
+        "/api/users/search", params={"q": "al", "match": "substring"}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_search_drops_renamed_and_deleted_users(client):
+    alice = await create_user(client, "alice")
+    bob = await create_user(client, "bob")
+    assert await search_users(client, "alice") == ["alice"]
+    assert await search_users(client, "bob") == ["bob"]
+    response = await client.patch(
+        f"/api/users/{alice['id']}",
+        json={"name": "carol", "email": "carol@example.com"},
+        headers=await log_in(client, "alice"),
+    )
+    assert response.status_code == status.HTTP_200_OK
+    response = await client.delete(
+        f"/api/users/{bob['id']}", headers=await log_in(client, "bob")
+    )
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert await search_users(client, "alice") == []
+    assert await search_users(client, "bob") == []
+    assert await search_users(client, "carol") == ["carol"]
+
+
+async def import_users(client, media_type: str, body: bytes) -> dict:
+    response = await client.post(
+        "/api/users/bulk", content=body, headers={"Content-Type": media_type}
+    )
+    assert response.status_code == status.HTTP_200_OK, response.text
+    return response.json()
+
+
+def user_record(name: str, password: str = "password") -> dict:
+    return {"name": name, "email": f"{name}@example.com", "password": password}
+
+
+async def test_import_users_ndjson(client):
+    await create_user(client, "alice")
+    body = formats.encode_ndjson(
+        [
+            user_record("bob"),
+            user_record("alice"),
+            user_record("bob"),
+            {"name": "carol", "email": "carol@example.com"},
+        ]
+    )
+    result = await import_users(client, formats.NDJSON, body + b"[1]\n")
+    assert result == {
+        "created": 1,
+        "errors": [
+            {"row": 2, "reason": "Name or email exists"},
+            {"row": 3, "reason": "Name or email exists"},
+            {"row": 4, "reason": "Missing password"},
+            {"row": 5, "reason": "Malformed record"},
+        ],
+    }
+    await log_in(client, "bob")
+    assert await count_users(client) == 2
+
+
+async def test_import_users_csv(client):
+    columns = ["name", "email", "password"]
+    body = formats.encode_csv_header(columns) + formats.encode_csv(
+        [user_record("alice"), user_record("bob")], columns
+    )
+    result = await import_users(client, f"{formats.CSV}; charset=utf-8", body)
+    assert result == {"created": 2, "errors": []}
+    await log_in(client, "alice")
+    await log_in(client, "bob")
+
+
+async def test_import_users_unsupported_format(client):
+    response = await client.post(
+        "/api/users/bulk",
+        content=b"alice",
+        headers={"Content-Type": "text/plain"},
+    )
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+
+async def test_import_users_rolls_back(client):
+    # Postgres text cannot hold NUL characters.
+    body = formats.encode_ndjson([user_record("alice"), user_record("b\0b")])
+    response = await client.post(
+        "/api/users/bulk",
+        content=body,
+        headers={"Content-Type": formats.NDJSON},
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert await count_users(client, "exact") == 0
+    await create_user(client, "alice")
+
+
+async def test_export_users(client, monkeypatch):
+    names = ["alice", "bob", "carol", "dave", "erin"]
+    body = formats.encode_ndjson([user_record(name) for name in names])
+    await import_users(client, formats.NDJSON, body)
+    monkeypatch.setattr("app.api.users.EXPORT_CHUNK_SIZE", 2)
+    with mock.patch(
+        "app.api.users.formats.encode_ndjson", wraps=formats.encode_ndjson
+    ) as encode_ndjson:
+        response = await client.get("/api/users/export")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["Content-Type"] == formats.NDJSON
+    users = [json.loads(line) for line in response.text.splitlines()]
+    assert [user["name"] for user in users] == names
+    assert [user["id"] for user in users] == sorted(
+        user["id"] for user in users
+    )
+    assert encode_ndjson.call_count == 3
+
+    response = await client.get("/api/users/export", params={"format": "csv"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["Content-Type"].startswith(formats.CSV)
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["name"] for row in rows] == names
+
+
+async def test_read_users_batch(client):
+    # Created users are cached, imported ones are not.
+    alice = await create_user(client, "alice")
+    body = formats.encode_ndjson([user_record("bob")])
+    await import_users(client, formats.NDJSON, body)
+    [bob] = (await client.get("/api/users/search", params={"q": "bob"})).json()
+    carol = await create_user(client, "carol")
+    response = await client.delete(
+        f"/api/users/{carol['id']}", headers=await log_in(client, "carol")
+    )
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    ids = [bob["id"], carol["id"] + 1, alice["id"], carol["id"], bob["id"]]
+    expected = [
+        [id, name is not None, name]
+        for id, name in zip(ids, ["bob", None, "alice", None, "bob"])
+    ]
+    # Tombstones of deleted users are looked up again, unknown ids never.
+    for read_ids in ([bob["id"], carol["id"]], [carol["id"]]):
+        with mock.patch(
+            "app.api.users.queries.execute", wraps=queries.execute
+        ) as execute:
+            response = await client.get(
+                "/api/users/batch",
+                params={"ids": ",".join(str(id) for id in ids)},
+            )
+        assert response.status_code == status.HTTP_200_OK
+        assert [
+            [lookup["id"], lookup["found"], (lookup["user"] or {}).get("name")]
+            for lookup in response.json()
+        ] == expected
+        [call] = execute.await_args_list
+        assert call.args[1] == "read_users"
+        assert call.kwargs["ids"] == read_ids